@@ -1,6 +1,6 @@
 from pathlib import Path
 import json
-from typing import Dict, Tuple, List, Optional
+from typing import Dict, Iterable, Iterator, Tuple, List, Optional, Set
 from .models import FileRecord
 from .default_rules import DEFAULT_EXTENSION_MAP, DEFAULT_OTHER_FOLDER
 
@@ -24,12 +24,38 @@ class RuleSet:
                 ext = "." + ext.lower()
             self.map[ext.lower()] = folder
 
-    def classify(self, rec: FileRecord) -> str:
-        ext = rec.ext.lower()
+    @classmethod
+    def from_mapping(cls, mapping: Dict[str, str]) -> "RuleSet":
+        """Rebuild a RuleSet from a saved effective mapping (see MoveLogger.record_rules)."""
+        rules = cls()
+        rules.map = dict(mapping)
+        return rules
+
+    def folders(self) -> Set[str]:
+        """Every folder these rules can send a file to."""
+        return set(self.map.values()) | {DEFAULT_OTHER_FOLDER}
+
+    def folder_for_ext(self, ext: str) -> str:
         if ext == "":
             return self.map.get("no_extension", DEFAULT_OTHER_FOLDER)
         return self.map.get(ext, DEFAULT_OTHER_FOLDER)
 
+    def diff(self, previous: "RuleSet") -> Dict[str, Tuple[str, str]]:
+        """
+        Extensions whose target folder changed since `previous`, as
+        ext -> (old folder, new folder). Files without a suffix use "".
+        """
+        changed: Dict[str, Tuple[str, str]] = {}
+        for key in set(self.map) | set(previous.map):
+            ext = "" if key == "no_extension" else key
+            old, new = previous.folder_for_ext(ext), self.folder_for_ext(ext)
+            if old != new:
+                changed[ext] = (old, new)
+        return changed
+
+    def classify(self, rec: FileRecord) -> str:
+        return self.folder_for_ext(rec.ext.lower())
+
 class Classifier:
     """Given a list of FileRecord, return (record, target_folder_name) tuples."""
     def __init__(self, rule_set: RuleSet):
@@ -37,3 +63,8 @@ class Classifier:
 
     def assign(self, files: List[FileRecord]) -> List[Tuple[FileRecord, str]]:
         return [(f, self.rules.classify(f)) for f in files]
+
+    def iter_assign(self, files: Iterable[FileRecord]) -> Iterator[Tuple[FileRecord, str]]:
+        """Lazy version of assign(); pairs are produced as files are consumed."""
+        for f in files:
+            yield f, self.rules.classify(f)
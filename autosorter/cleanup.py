@@ -0,0 +1,41 @@
+from pathlib import Path
+from typing import Iterable, List, Optional, Set
+
+from .filesystem import FileSystem, LOCAL_FS
+from .models import MoveResult
+
+
+class EmptyDirCollapser:
+    """
+    Removes directories left empty by a batch. Works only from the set of
+    directories the batch moved files out of (plus their ancestors up to
+    root), visited deepest-first in one pass, so nothing is rescanned: a
+    directory is empty exactly when rmdir succeeds.
+    """
+    def __init__(self, root: Path, dry_run: bool = False, fs: Optional[FileSystem] = None):
+        self.root = root
+        self.dry_run = dry_run
+        self.fs = fs or LOCAL_FS
+
+    def collapse(self, touched: Iterable[Path]) -> List[MoveResult]:
+        # Emptiness depends on the moves having happened; nothing to preview
+        if self.dry_run:
+            return []
+
+        candidates: Set[Path] = set()
+        for d in touched:
+            # Only directories strictly inside root; never root itself
+            while d != self.root and self.root in d.parents:
+                if d in candidates:
+                    break  # ancestors already added via a sibling
+                candidates.add(d)
+                d = d.parent
+
+        results: List[MoveResult] = []
+        for d in sorted(candidates, key=lambda p: len(p.parts), reverse=True):
+            try:
+                self.fs.rmdir(d)
+            except OSError:
+                continue  # not empty (or gone / not allowed): keep it
+            results.append(MoveResult(d, d, performed=True, action="rmdir"))
+        return results
@@ -0,0 +1,685 @@
+import errno
+import io
+import os
+import random
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import IO, Dict, Iterator, NamedTuple, Optional, Set, Tuple
+
+from .locking import FileLock
+
+try:
+    import fcntl  # POSIX only; reflinks are skipped elsewhere
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+
+class FileStat(NamedTuple):
+    """The subset of os.stat_result the sorter relies on."""
+    st_size: int
+    st_mtime: float
+    st_dev: int
+    st_ino: int
+    st_nlink: int = 1
+
+
+class FileSystem:
+    """
+    Everything the scanner, mover and undo need from a filesystem. Backends
+    implement the primitives; move() and make_link() are built on top of them.
+    """
+
+    # ---- primitives ----
+    def exists(self, path: Path) -> bool:
+        raise NotImplementedError
+
+    def is_file(self, path: Path) -> bool:
+        raise NotImplementedError
+
+    def is_dir(self, path: Path) -> bool:
+        raise NotImplementedError
+
+    def is_symlink(self, path: Path) -> bool:
+        raise NotImplementedError
+
+    def stat(self, path: Path):
+        raise NotImplementedError
+
+    def lstat(self, path: Path):
+        raise NotImplementedError
+
+    def iter_files(self, root: Path, recursive: bool = True) -> Iterator[Path]:
+        """Yield paths of regular files (or links to them) under root."""
+        raise NotImplementedError
+
+    def iter_dirs(self, root: Path, recursive: bool = True, skip_hidden: bool = True) -> Iterator[Path]:
+        """Yield root and (optionally) every directory below it, without touching files."""
+        raise NotImplementedError
+
+    def mkdir(self, path: Path) -> None:
+        """Create path and missing parents; existing directories are fine."""
+        raise NotImplementedError
+
+    def rename(self, src: Path, dst: Path) -> None:
+        """Atomic same-device rename. Raises EXDEV across devices."""
+        raise NotImplementedError
+
+    def replace(self, src: Path, dst: Path) -> None:
+        """Like rename(), but always replaces an existing dst (os.replace)."""
+        raise NotImplementedError
+
+    def copy(self, src: Path, dst: Path) -> None:
+        """Copy data and timestamps."""
+        raise NotImplementedError
+
+    def unlink(self, path: Path) -> None:
+        raise NotImplementedError
+
+    def rmdir(self, path: Path) -> None:
+        """Remove an empty directory. Raises OSError (ENOTEMPTY) otherwise."""
+        raise NotImplementedError
+
+    def hardlink(self, src: Path, dst: Path) -> None:
+        raise NotImplementedError
+
+    def reflink(self, src: Path, dst: Path) -> None:
+        raise NotImplementedError
+
+    def symlink(self, src: Path, dst: Path) -> None:
+        raise NotImplementedError
+
+    def readlink(self, path: Path) -> Path:
+        """Target of the symlink at path. Raises OSError if path is not a symlink."""
+        raise NotImplementedError
+
+    def create_new(self, path: Path) -> None:
+        """Create an empty file; FileExistsError if the name is taken (even by a dangling symlink)."""
+        raise NotImplementedError
+
+    def open(self, path: Path, mode: str = "r", encoding: Optional[str] = None,
+             newline: Optional[str] = None) -> IO:
+        """Open a file like the builtin; used for the .autosorter logs."""
+        raise NotImplementedError
+
+    def fsync(self, f: IO) -> None:
+        """Flush f and make its contents durable."""
+        raise NotImplementedError
+
+    def lock(self, path: Path, exclusive: bool = True):
+        """Advisory lock named by path; a context manager with acquire()/release()."""
+        raise NotImplementedError
+
+    def samefile(self, a: Path, b: Path) -> bool:
+        sa, sb = self.stat(a), self.stat(b)
+        return (sa.st_dev, sa.st_ino) == (sb.st_dev, sb.st_ino)
+
+    # ---- composites ----
+    def lexists(self, path: Path) -> bool:
+        """Whether the name is taken; unlike exists(), a dangling symlink counts."""
+        return self.exists(path) or self.is_symlink(path)
+
+    def move(self, src: Path, dst: Path) -> None:
+        """Like shutil.move for a single file: rename, or copy + unlink across devices."""
+        try:
+            self.rename(src, dst)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            self.copy(src, dst)
+            self.unlink(src)
+
+    def make_link(self, src: Path, dst: Path) -> str:
+        """
+        Materialize src at dst without moving it. Tries a hardlink (same device),
+        then a reflink clone, then a symlink. Returns the action that worked.
+        """
+        try:
+            same_dev = self.stat(src).st_dev == self.stat(dst.parent).st_dev
+        except OSError:
+            same_dev = False
+        if same_dev:
+            try:
+                self.hardlink(src, dst)
+                return "hardlink"
+            except OSError:
+                pass  # e.g. FS without hardlinks or link count limit
+        try:
+            self.reflink(src, dst)
+            return "reflink"
+        except OSError:
+            pass
+        self.symlink(src, dst)
+        return "symlink"
+
+
+class LocalFileSystem(FileSystem):
+    """The real OS, via os/shutil/pathlib."""
+
+    def exists(self, path: Path) -> bool:
+        return path.exists()
+
+    def is_file(self, path: Path) -> bool:
+        return path.is_file()
+
+    def is_dir(self, path: Path) -> bool:
+        return path.is_dir()
+
+    def is_symlink(self, path: Path) -> bool:
+        return path.is_symlink()
+
+    def stat(self, path: Path):
+        return os.stat(path)
+
+    def lstat(self, path: Path):
+        return os.lstat(path)
+
+    def iter_files(self, root: Path, recursive: bool = True) -> Iterator[Path]:
+        paths = root.rglob("*") if recursive else root.glob("*")
+        for p in paths:
+            if p.is_file():
+                yield p
+
+    def iter_dirs(self, root: Path, recursive: bool = True, skip_hidden: bool = True) -> Iterator[Path]:
+        if not recursive:
+            yield root
+            return
+        for dirpath, dirnames, _ in os.walk(root):
+            if skip_hidden:
+                dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+            yield Path(dirpath)
+
+    def mkdir(self, path: Path) -> None:
+        path.mkdir(parents=True, exist_ok=True)
+
+    def rename(self, src: Path, dst: Path) -> None:
+        os.rename(src, dst)
+
+    def replace(self, src: Path, dst: Path) -> None:
+        os.replace(src, dst)
+
+    def copy(self, src: Path, dst: Path) -> None:
+        shutil.copy2(src, dst)
+
+    def unlink(self, path: Path) -> None:
+        os.unlink(path)
+
+    def rmdir(self, path: Path) -> None:
+        os.rmdir(path)
+
+    def hardlink(self, src: Path, dst: Path) -> None:
+        os.link(src, dst)
+
+    def reflink(self, src: Path, dst: Path) -> None:
+        if fcntl is None:
+            raise OSError(errno.EOPNOTSUPP, "reflinks not supported on this platform", str(dst))
+        with open(src, "rb") as fsrc:
+            # Never write through whatever already holds the name, e.g. a dangling symlink
+            fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_NOFOLLOW", 0), 0o666)
+            try:
+                try:
+                    fcntl.ioctl(fd, FICLONE, fsrc.fileno())
+                finally:
+                    os.close(fd)
+                shutil.copystat(src, dst)
+            except OSError:
+                try:
+                    os.unlink(dst)
+                except OSError:
+                    pass
+                raise
+
+    def symlink(self, src: Path, dst: Path) -> None:
+        os.symlink(src, dst)
+
+    def readlink(self, path: Path) -> Path:
+        return Path(os.readlink(path))
+
+    def create_new(self, path: Path) -> None:
+        os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_NOFOLLOW", 0), 0o666))
+
+    def open(self, path: Path, mode: str = "r", encoding: Optional[str] = None,
+             newline: Optional[str] = None) -> IO:
+        return open(path, mode, encoding=encoding, newline=newline)
+
+    def fsync(self, f: IO) -> None:
+        f.flush()
+        os.fsync(f.fileno())
+
+    def lock(self, path: Path, exclusive: bool = True) -> FileLock:
+        return FileLock(path, exclusive)
+
+    def samefile(self, a: Path, b: Path) -> bool:
+        return os.path.samefile(a, b)
+
+    def move(self, src: Path, dst: Path) -> None:
+        shutil.move(str(src), str(dst))
+
+
+class _Inode:
+    __slots__ = ("size", "mtime", "dev", "ino", "nlink", "data")
+
+    def __init__(self, size: int, mtime: float, dev: int, ino: int):
+        self.size = size
+        self.mtime = mtime
+        self.dev = dev
+        self.ino = ino
+        self.nlink = 1
+        self.data: Optional[bytearray] = None  # only files written through open()
+
+
+class _MemoryFile(io.BytesIO):
+    """
+    Write handle for MemoryFileSystem. Contents land in the inode on every
+    flush; in append mode only the new bytes are kept here and then appended,
+    so growing a log never copies what is already stored.
+    """
+    def __init__(self, node: _Inode, append: bool):
+        super().__init__()
+        self._node = node
+        self._append = append
+        if not append:
+            node.data = bytearray()
+            node.size = 0
+
+    def flush(self) -> None:
+        super().flush()
+        if self.closed:
+            return
+        chunk = self.getvalue()
+        if self._append:
+            self._node.data.extend(chunk)
+            self.seek(0)
+            self.truncate()
+        else:
+            self._node.data[:] = chunk
+        self._node.size = len(self._node.data)
+        self._node.mtime = time.time()
+
+    def close(self) -> None:
+        if not self.closed:
+            self.flush()
+        super().close()
+
+
+class _MemoryLock:
+    """In-process stand-in for FileLock (shared locks are exclusive here too)."""
+    def __init__(self, lock: threading.Lock):
+        self._lock = lock
+
+    def acquire(self) -> None:
+        self._lock.acquire()
+
+    def release(self) -> None:
+        self._lock.release()
+
+    def __enter__(self) -> "_MemoryLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.release()
+
+
+class MemoryFileSystem(FileSystem):
+    """
+    Purely in-memory tree holding only metadata (size, mtime), so millions of
+    virtual files fit comfortably. Devices are simulated with mount() so
+    cross-device renames raise EXDEV like the real thing.
+    """
+
+    def __init__(self):
+        self._files: Dict[str, _Inode] = {}
+        self._symlinks: Dict[str, str] = {}
+        self._children: Dict[str, Set[str]] = {"/": set()}
+        self._mounts: Dict[str, int] = {"/": 0}
+        self._next_ino = 1
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    # ---- setup helpers ----
+    def mount(self, path: Path, dev: int) -> None:
+        """Treat everything under path as living on device dev."""
+        self.mkdir(path)
+        self._mounts[str(path)] = dev
+
+    def add_file(self, path: Path, size: int = 0, mtime: Optional[float] = None) -> None:
+        parent = str(path.parent)
+        if parent not in self._children:
+            self.mkdir(path.parent)
+        key = str(path)
+        self._files[key] = self._new_inode(size, time.time() if mtime is None else mtime, key)
+        self._children[parent].add(path.name)
+
+    # ---- primitives ----
+    def exists(self, path: Path) -> bool:
+        key = self._resolve(str(path))
+        return key is not None and (key in self._files or key in self._children)
+
+    def is_file(self, path: Path) -> bool:
+        key = self._resolve(str(path))
+        return key is not None and key in self._files
+
+    def is_dir(self, path: Path) -> bool:
+        key = self._resolve(str(path))
+        return key is not None and key in self._children
+
+    def is_symlink(self, path: Path) -> bool:
+        return str(path) in self._symlinks
+
+    def stat(self, path: Path) -> FileStat:
+        key = self._resolve(str(path))
+        if key is None:
+            raise FileNotFoundError(errno.ENOENT, "No such file or directory", str(path))
+        return self._stat_key(key, str(path))
+
+    def lstat(self, path: Path) -> FileStat:
+        key = str(path)
+        if key in self._symlinks:
+            return FileStat(len(self._symlinks[key]), 0.0, self._dev_of(key), 0)
+        return self._stat_key(key, key)
+
+    def iter_files(self, root: Path, recursive: bool = True) -> Iterator[Path]:
+        stack = [str(root)]
+        while stack:
+            d = stack.pop()
+            for name in sorted(self._children.get(d, ())):
+                child = d.rstrip("/") + "/" + name
+                if child in self._children:
+                    if recursive:
+                        stack.append(child)
+                elif self.is_file(Path(child)):
+                    yield Path(child)
+
+    def iter_dirs(self, root: Path, recursive: bool = True, skip_hidden: bool = True) -> Iterator[Path]:
+        stack = [str(root)]
+        while stack:
+            d = stack.pop()
+            if d not in self._children:
+                continue
+            yield Path(d)
+            if not recursive:
+                return
+            for name in self._children[d]:
+                child = d.rstrip("/") + "/" + name
+                if child in self._children and not (skip_hidden and name.startswith(".")):
+                    stack.append(child)
+
+    def mkdir(self, path: Path) -> None:
+        key = str(path)
+        if key in self._children:
+            return
+        if key in self._files or key in self._symlinks:
+            raise FileExistsError(errno.EEXIST, "File exists", key)
+        parent = str(path.parent)
+        if parent != key:
+            self.mkdir(path.parent)
+            self._children[parent].add(path.name)
+        self._children[key] = set()
+
+    def replace(self, src: Path, dst: Path) -> None:
+        self.rename(src, dst)
+
+    def rename(self, src: Path, dst: Path) -> None:
+        s, d = str(src), str(dst)
+        self._require_parent(dst)
+        if self._dev_of(s) != self._dev_of(d):
+            raise OSError(errno.EXDEV, "Invalid cross-device link", s)
+        if s not in self._symlinks and s not in self._files:
+            raise FileNotFoundError(errno.ENOENT, "No such file or directory", s)
+        if d != s:
+            self._discard(d)
+        if s in self._symlinks:
+            self._symlinks[d] = self._symlinks.pop(s)
+        else:
+            self._files[d] = self._files.pop(s)
+        self._children[str(src.parent)].discard(src.name)
+        self._children[str(dst.parent)].add(dst.name)
+
+    def copy(self, src: Path, dst: Path) -> None:
+        st = self.stat(src)
+        self._require_parent(dst)
+        d = str(dst)
+        self._discard(d)
+        self._files[d] = self._new_inode(st.st_size, st.st_mtime, d)
+        self._children[str(dst.parent)].add(dst.name)
+
+    def unlink(self, path: Path) -> None:
+        key = str(path)
+        if not self._discard(key):
+            raise FileNotFoundError(errno.ENOENT, "No such file or directory", key)
+        self._children[str(path.parent)].discard(path.name)
+
+    def rmdir(self, path: Path) -> None:
+        key = str(path)
+        children = self._children.get(key)
+        if children is None:
+            raise FileNotFoundError(errno.ENOENT, "No such file or directory", key)
+        if children:
+            raise OSError(errno.ENOTEMPTY, "Directory not empty", key)
+        del self._children[key]
+        self._children[str(path.parent)].discard(path.name)
+
+    def hardlink(self, src: Path, dst: Path) -> None:
+        s, d = self._resolve(str(src)), str(dst)
+        if s is None or s not in self._files:
+            raise FileNotFoundError(errno.ENOENT, "No such file or directory", str(src))
+        self._require_free(dst)
+        if self._dev_of(s) != self._dev_of(d):
+            raise OSError(errno.EXDEV, "Invalid cross-device link", d)
+        self._files[d] = self._files[s]
+        self._files[d].nlink += 1
+        self._children[str(dst.parent)].add(dst.name)
+
+    def reflink(self, src: Path, dst: Path) -> None:
+        self._require_free(dst)
+        if self._dev_of(str(src)) != self._dev_of(str(dst)):
+            raise OSError(errno.EXDEV, "Invalid cross-device link", str(dst))
+        self.copy(src, dst)
+
+    def symlink(self, src: Path, dst: Path) -> None:
+        self._require_free(dst)
+        self._symlinks[str(dst)] = str(src)
+        self._children[str(dst.parent)].add(dst.name)
+
+    def readlink(self, path: Path) -> Path:
+        target = self._symlinks.get(str(path))
+        if target is None:
+            raise OSError(errno.EINVAL, "Invalid argument", str(path))
+        return Path(target)
+
+    def create_new(self, path: Path) -> None:
+        self._require_free(path)
+        self.add_file(path)
+
+    def open(self, path: Path, mode: str = "r", encoding: Optional[str] = None,
+             newline: Optional[str] = None) -> IO:
+        key = self._resolve(str(path)) or str(path)
+        node = self._files.get(key)
+        if "r" in mode:
+            if node is None:
+                raise FileNotFoundError(errno.ENOENT, "No such file or directory", str(path))
+            raw = io.BytesIO(bytes(node.data) if node.data is not None else bytes(node.size))
+        else:
+            if node is None:
+                self._require_free(path)
+                self.add_file(path)
+                node = self._files[key]
+            if node.data is None:
+                node.data = bytearray(node.size)
+            raw = _MemoryFile(node, append="a" in mode)
+        if "b" in mode:
+            return raw
+        return io.TextIOWrapper(raw, encoding=encoding or "utf-8", newline=newline)
+
+    def fsync(self, f: IO) -> None:
+        f.flush()
+
+    def lock(self, path: Path, exclusive: bool = True) -> _MemoryLock:
+        with self._locks_guard:
+            lock = self._locks.setdefault(str(path), threading.Lock())
+        return _MemoryLock(lock)
+
+    # ---- internals ----
+    def _new_inode(self, size: int, mtime: float, key: str) -> _Inode:
+        self._next_ino += 1
+        return _Inode(size, mtime, self._dev_of(key), self._next_ino)
+
+    def _discard(self, key: str) -> bool:
+        """Drop a file or symlink entry (not its directory listing); False if absent."""
+        if key in self._symlinks:
+            del self._symlinks[key]
+            return True
+        node = self._files.pop(key, None)
+        if node is None:
+            return False
+        node.nlink -= 1
+        return True
+
+    def _stat_key(self, key: str, shown: str) -> FileStat:
+        node = self._files.get(key)
+        if node is not None:
+            return FileStat(node.size, node.mtime, node.dev, node.ino, node.nlink)
+        if key in self._children:
+            return FileStat(0, 0.0, self._dev_of(key), 0)
+        raise FileNotFoundError(errno.ENOENT, "No such file or directory", shown)
+
+    def _resolve(self, key: str) -> Optional[str]:
+        # Follow symlinks (bounded, like ELOOP); None when dangling
+        for _ in range(40):
+            target = self._symlinks.get(key)
+            if target is None:
+                return key
+            key = target
+        return None
+
+    def _dev_of(self, key: str) -> int:
+        # Longest mount prefix wins; there are only ever a handful of mounts
+        best, dev = "", 0
+        for mount, mdev in self._mounts.items():
+            prefix = mount.rstrip("/") + "/"
+            if (key == mount or key.startswith(prefix)) and len(mount) > len(best):
+                best, dev = mount, mdev
+        return dev
+
+    def _require_parent(self, dst: Path) -> None:
+        if str(dst.parent) not in self._children:
+            raise FileNotFoundError(errno.ENOENT, "No such file or directory", str(dst.parent))
+
+    def _require_free(self, dst: Path) -> None:
+        self._require_parent(dst)
+        key = str(dst)
+        if key in self._files or key in self._symlinks or key in self._children:
+            raise FileExistsError(errno.EEXIST, "File exists", key)
+
+
+class FaultInjectingFileSystem(FileSystem):
+    """
+    Wraps another backend, adding per-call latency and random errors.
+
+    faults maps a primitive name ("rename", "copy", "mkdir", ...) to
+    (probability, errno), e.g. {"rename": (0.01, errno.EXDEV),
+    "copy": (0.001, errno.ENOSPC)}. Since move() is built from rename and
+    copy, an injected EXDEV exercises the copy fallback just like a real
+    cross-device move.
+    """
+
+    def __init__(self, inner: FileSystem, latency: float = 0.0,
+                 faults: Optional[Dict[str, Tuple[float, int]]] = None,
+                 seed: Optional[int] = None):
+        self.inner = inner
+        self.latency = latency
+        self.faults = dict(faults or {})
+        self.rng = random.Random(seed)
+        self.calls: Dict[str, int] = {}
+        self.injected: Dict[str, int] = {}
+
+    def _call(self, op: str, *args):
+        self.calls[op] = self.calls.get(op, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+        fault = self.faults.get(op)
+        if fault is not None and self.rng.random() < fault[0]:
+            self.injected[op] = self.injected.get(op, 0) + 1
+            code = fault[1]
+            path = next((a for a in reversed(args) if isinstance(a, Path)), None)
+            raise OSError(code, f"injected: {os.strerror(code)}", str(path) if path else None)
+        return getattr(self.inner, op)(*args)
+
+    def exists(self, path: Path) -> bool:
+        return self._call("exists", path)
+
+    def is_file(self, path: Path) -> bool:
+        return self._call("is_file", path)
+
+    def is_dir(self, path: Path) -> bool:
+        return self._call("is_dir", path)
+
+    def is_symlink(self, path: Path) -> bool:
+        return self._call("is_symlink", path)
+
+    def stat(self, path: Path):
+        return self._call("stat", path)
+
+    def lstat(self, path: Path):
+        return self._call("lstat", path)
+
+    def iter_files(self, root: Path, recursive: bool = True) -> Iterator[Path]:
+        return self._call("iter_files", root, recursive)
+
+    def iter_dirs(self, root: Path, recursive: bool = True, skip_hidden: bool = True) -> Iterator[Path]:
+        return self._call("iter_dirs", root, recursive, skip_hidden)
+
+    def mkdir(self, path: Path) -> None:
+        self._call("mkdir", path)
+
+    def rename(self, src: Path, dst: Path) -> None:
+        self._call("rename", src, dst)
+
+    def replace(self, src: Path, dst: Path) -> None:
+        self._call("replace", src, dst)
+
+    def copy(self, src: Path, dst: Path) -> None:
+        self._call("copy", src, dst)
+
+    def unlink(self, path: Path) -> None:
+        self._call("unlink", path)
+
+    def rmdir(self, path: Path) -> None:
+        self._call("rmdir", path)
+
+    def hardlink(self, src: Path, dst: Path) -> None:
+        self._call("hardlink", src, dst)
+
+    def reflink(self, src: Path, dst: Path) -> None:
+        self._call("reflink", src, dst)
+
+    def symlink(self, src: Path, dst: Path) -> None:
+        self._call("symlink", src, dst)
+
+    def readlink(self, path: Path) -> Path:
+        return self._call("readlink", path)
+
+    def create_new(self, path: Path) -> None:
+        self._call("create_new", path)
+
+    def open(self, path: Path, mode: str = "r", encoding: Optional[str] = None,
+             newline: Optional[str] = None) -> IO:
+        return self._call("open", path, mode, encoding, newline)
+
+    def fsync(self, f: IO) -> None:
+        self._call("fsync", f)
+
+    def lock(self, path: Path, exclusive: bool = True):
+        # Locks only coordinate runs; they are never slowed down or failed
+        return self.inner.lock(path, exclusive)
+
+    def samefile(self, a: Path, b: Path) -> bool:
+        return self._call("samefile", a, b)
+
+
+LOCAL_FS = LocalFileSystem()
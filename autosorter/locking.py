@@ -0,0 +1,82 @@
+import hashlib
+import os
+from pathlib import Path
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """
+    Advisory lock on a lock file (flock on POSIX, msvcrt on Windows).
+    Each acquisition opens its own descriptor, so it also excludes other
+    threads of the same process. Windows has no shared locks; there every
+    lock is exclusive.
+    """
+    def __init__(self, path: Path, exclusive: bool = True):
+        self.path = path
+        self.exclusive = exclusive
+        self._fd: Optional[int] = None
+
+    def acquire(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(str(self.path), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+        except OSError:
+            os.close(fd)
+            raise
+        self._fd = fd
+
+    def release(self) -> None:
+        if self._fd is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.release()
+
+
+class DestinationLocks:
+    """
+    Fine-grained locks under <root>/.autosorter/locks: one per destination
+    folder (held while a free name is picked and the file lands there) and
+    one per batch (held while a batch is undone). Runs touching different
+    folders or batches never wait on each other. With an fs backend the
+    locks come from fs.lock(), so in-memory runs never touch the disk.
+    """
+    def __init__(self, root: Path, fs=None):
+        self.lock_dir = root / ".autosorter" / "locks"
+        self.fs = fs
+
+    def folder(self, folder: Path):
+        return self._lock(self.lock_dir / f"dir-{_digest(str(folder))}.lock")
+
+    def batch(self, batch_id: str):
+        return self._lock(self.lock_dir / f"batch-{batch_id}.lock")
+
+    def _lock(self, path: Path):
+        # fs is untyped: filesystem.py imports this module
+        return self.fs.lock(path) if self.fs is not None else FileLock(path)
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
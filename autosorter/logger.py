@@ -1,71 +1,386 @@
 import csv
+import hashlib
+import io
 import json
+import os
+import threading
+import time
 from pathlib import Path
 from datetime import datetime
-from typing import Iterable, List
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
+from .filesystem import FileSystem, LOCAL_FS
 from .models import MoveLogEntry
+from .utils import atomic_write_text
+
+INDEX_BUILD_CHUNK = 4096  # rows buffered (all extensions together) while building the index
+
+_id_lock = threading.Lock()
+_last_id_ns = 0
+
+
+def new_batch_id() -> str:
+    """
+    Sortable, unique batch id: second-resolution timestamp (as before) plus
+    a strictly increasing nanosecond tail and the pid, so runs started in the
+    same second — in this process or another one — never share an id.
+    """
+    global _last_id_ns
+    with _id_lock:
+        now = max(time.time_ns(), _last_id_ns + 1)
+        _last_id_ns = now
+    stamp = datetime.fromtimestamp(now // 1_000_000_000).strftime("%Y%m%d-%H%M%S")
+    return f"{stamp}-{now % 1_000_000_000:09d}-{os.getpid()}"
 
 class MoveLogger:
-    """Append-only logger. Also writes a JSON file per batch for quick undo."""
-    def __init__(self, root: Path):
+    """
+    Append-only logger. Also writes a JSON file per batch for quick undo.
+    All storage and locking goes through fs, so a MemoryFileSystem run keeps
+    its history in memory too.
+    """
+    def __init__(self, root: Path, fs: Optional[FileSystem] = None):
         self.root = root
+        self.fs = fs or LOCAL_FS
         self.meta_dir = self.root / ".autosorter"
-        self.meta_dir.mkdir(parents=True, exist_ok=True)
+        self.fs.mkdir(self.meta_dir)
         self.csv_path = self.meta_dir / "moves.csv"
+        self.links_path = self.meta_dir / "links.json"
+        self.lock_path = self.meta_dir / "lock"
+        self.rules_path = self.meta_dir / "rules_snapshot.json"
+        self.index_dir = self.meta_dir / "index"
+        self.index_done = self.index_dir / "complete"
 
-        # Ensure CSV header exists
-        if not self.csv_path.exists():
-            with self.csv_path.open("w", newline="", encoding="utf-8") as f:
-                writer = csv.writer(f)
-                writer.writerow(["batch_id", "src", "dst", "timestamp"])
+        # Ensure CSV header exists (another process may be doing the same)
+        if not self.fs.exists(self.csv_path):
+            with self.lock():
+                if not self.fs.exists(self.csv_path):
+                    atomic_write_text(self.csv_path, _csv_text([["batch_id", "src", "dst", "timestamp", "action"]]),
+                                      self.fs)
+
+    def lock(self, exclusive: bool = True):
+        """Advisory lock guarding the shared files (moves.csv, links.json)."""
+        return self.fs.lock(self.lock_path, exclusive)
 
     def write_batch(self, entries: Iterable[MoveLogEntry]) -> None:
-        entries = list(entries)
-        if not entries:
+        it = iter(entries)
+        first = next(it, None)
+        if first is None:
             return
+        with self.open_batch(first.batch_id) as writer:
+            writer.write([first])
+            writer.write(it)
 
-        # CSV append
-        with self.csv_path.open("a", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            for e in entries:
-                writer.writerow([
-                    e.batch_id,
-                    str(e.src),
-                    str(e.dst),
-                    e.timestamp.isoformat(),
-                ])
-
-        # JSON snapshot for the batch
-        batch_file = self.meta_dir / f"{entries[0].batch_id}.json"
-        data = [
-            {"src": str(e.src), "dst": str(e.dst), "timestamp": e.timestamp.isoformat()}
-            for e in entries
-        ]
-        batch_file.write_text(json.dumps(data, indent=2), encoding="utf-8")
+    def open_batch(self, batch_id: str) -> "BatchWriter":
+        """Incremental writer for one batch; use when entries come in chunks."""
+        return BatchWriter(self, batch_id)
+
+    def open_undo(self, batch_id: str) -> "BatchWriter":
+        """
+        Writer for the "undo" rows of undoing batch_id (src = where the file
+        was, dst = where it went back). They go to moves.csv and the index so
+        the history can follow the file; the batch file is left alone.
+        """
+        return BatchWriter(self, batch_id, batch_file=False)
 
     def list_batches(self) -> List[str]:
         """Return batch ids sorted newest→oldest."""
-        ids = []
-        with self.csv_path.open("r", encoding="utf-8") as f:
+        ids = set()
+        with self.lock(exclusive=False), self.fs.open(self.csv_path, "r", encoding="utf-8") as f:
             reader = csv.DictReader(f)
             for row in reader:
-                ids.append(row["batch_id"])
-        return sorted(set(ids), reverse=True)
+                ids.add(row["batch_id"])
+        return sorted(ids, reverse=True)
 
     def load_batch(self, batch_id: str) -> List[MoveLogEntry]:
+        return list(self.iter_batch(batch_id))
+
+    def iter_batch(self, batch_id: str, reverse: bool = False) -> Iterator[MoveLogEntry]:
+        """Stream a batch's entries; reverse=True yields newest first (used by undo)."""
         path = self.meta_dir / f"{batch_id}.json"
-        if not path.exists():
-            return []
-        raw = json.loads(path.read_text(encoding="utf-8"))
-        out: List[MoveLogEntry] = []
-        for item in raw:
-            out.append(
-                MoveLogEntry(
-                    batch_id=batch_id,
-                    src=Path(item["src"]),
-                    dst=Path(item["dst"]),
-                    timestamp=datetime.fromisoformat(item["timestamp"]),
-                )
+        if not self.fs.exists(path):
+            return
+        for item in _iter_json_array(self.fs, path, reverse):
+            yield MoveLogEntry(
+                batch_id=batch_id,
+                src=Path(item["src"]),
+                dst=Path(item["dst"]),
+                timestamp=datetime.fromisoformat(item["timestamp"]),
+                action=item.get("action", "move"),
             )
-        return out
+
+    def iter_moves(self) -> Iterator[MoveLogEntry]:
+        """Stream every file move and undo row (all batches, oldest first) from moves.csv."""
+        with self.fs.open(self.csv_path, "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                # Files started before the action column: extra value lands under None
+                action = row.get("action") or (row.get(None) or ["move"])[0]
+                if action not in ("move", "undo"):
+                    continue
+                yield MoveLogEntry(
+                    batch_id=row["batch_id"],
+                    src=Path(row["src"]),
+                    dst=Path(row["dst"]),
+                    timestamp=datetime.fromisoformat(row["timestamp"]),
+                    action=action,
+                )
+
+    # ---------------- Per-extension index ----------------
+    def ensure_index(self) -> None:
+        """
+        index/ holds the move and undo rows of moves.csv split by extension,
+        appended by BatchWriter. Roots organized before it existed get it
+        built from moves.csv once, here.
+        """
+        if self.fs.exists(self.index_done):
+            return
+        with self.lock():
+            if self.fs.exists(self.index_done):
+                return
+            self.fs.mkdir(self.index_dir)
+            for path in list(self.fs.iter_files(self.index_dir, recursive=False)):
+                self.fs.unlink(path)  # left by an interrupted build
+            # Bounded by the total row count, however many distinct suffixes there are
+            pending: Dict[str, List[MoveLogEntry]] = {}
+            buffered = 0
+            for e in self.iter_moves():
+                pending.setdefault(e.dst.suffix.lower(), []).append(e)
+                buffered += 1
+                if buffered >= INDEX_BUILD_CHUNK:
+                    self._flush_index(pending)
+                    buffered = 0
+            self._flush_index(pending)
+            atomic_write_text(self.index_done, "", self.fs)
+
+    def iter_index(self, ext: str) -> Iterator[MoveLogEntry]:
+        """
+        Move and undo rows for files with extension ext, oldest first.
+        Call ensure_index() first and hold lock(exclusive=False) while reading.
+        """
+        path = self.index_dir / _index_name(ext)
+        if not self.fs.exists(path):
+            return
+        with self.fs.open(path, "r", encoding="utf-8", newline="") as f:
+            for row in csv.reader(f):
+                try:
+                    batch_id, src, dst, stamp, action = row
+                    timestamp = datetime.fromisoformat(stamp)
+                except ValueError:
+                    continue  # cut-off last row of a killed run
+                yield MoveLogEntry(batch_id, Path(src), Path(dst), timestamp, action)
+
+    def _flush_index(self, pending: Dict[str, List[MoveLogEntry]]) -> None:
+        for ext, rows in pending.items():
+            self._append_index(ext, rows)
+        pending.clear()
+
+    def _append_index(self, ext: str, entries: List[MoveLogEntry]) -> None:
+        # Caller holds lock()
+        text = _csv_text([e.batch_id, str(e.src), str(e.dst), e.timestamp.isoformat(), e.action]
+                         for e in entries)
+        with self.fs.open(self.index_dir / _index_name(ext), "a", encoding="utf-8", newline="") as f:
+            f.write(text)
+
+    # ---------------- Rule versions ----------------
+    def load_rule_versions(self) -> List[Dict[str, str]]:
+        """
+        Extension maps recorded by batches that have not been undone, i.e.
+        every rule version that may still decide where archived files sit.
+        """
+        return [v["rules"] for v in self._load_versions()]
+
+    def record_rules(self, batch_id: str, mapping: Dict[str, str]) -> None:
+        """Note that batch_id placed files by mapping (see Reclassifier)."""
+        with self.lock():
+            versions = self._load_versions()
+            for v in versions:
+                if v["rules"] == mapping:
+                    v["batches"].append(batch_id)
+                    break
+            else:
+                versions.append({"rules": dict(mapping), "batches": [batch_id]})
+            self._save_versions(versions)
+
+    def forget_rules(self, batch_id: str) -> None:
+        """Drop batch_id's rules record, e.g. once it has been undone."""
+        with self.lock():
+            versions = self._load_versions()
+            kept = []
+            for v in versions:
+                if batch_id in v["batches"]:
+                    v["batches"].remove(batch_id)
+                    if not v["batches"]:
+                        continue
+                kept.append(v)
+            self._save_versions(kept)
+
+    def _load_versions(self) -> List[dict]:
+        if not self.fs.exists(self.rules_path):
+            return []
+        return json.loads(self._read_text(self.rules_path))["versions"]
+
+    def _save_versions(self, versions: List[dict]) -> None:
+        atomic_write_text(self.rules_path, json.dumps({"versions": versions}, indent=2, sort_keys=True), self.fs)
+
+    # ---------------- Link view ----------------
+    def load_link_view(self) -> Dict[Path, Tuple[Path, str]]:
+        """Return the current link view as src -> (link path, action)."""
+        if not self.fs.exists(self.links_path):
+            return {}
+        raw = json.loads(self._read_text(self.links_path))
+        return {Path(src): (Path(item["dst"]), item["action"]) for src, item in raw.items()}
+
+    def save_link_view(self, view: Dict[Path, Tuple[Path, str]]) -> None:
+        data = {str(src): {"dst": str(dst), "action": action} for src, (dst, action) in view.items()}
+        atomic_write_text(self.links_path, json.dumps(data, indent=2), self.fs)
+
+    def apply_to_link_view(self, entries: Iterable[MoveLogEntry]) -> None:
+        """Fold link/unlink entries into links.json (moves, undos and rmdirs are ignored)."""
+        with self.lock():
+            view = self.load_link_view()
+            for e in entries:
+                if e.action in ("move", "undo", "rmdir"):
+                    continue
+                if e.action == "unlink":
+                    if e.src in view and view[e.src][0] == e.dst:
+                        del view[e.src]
+                else:
+                    view[e.src] = (e.dst, e.action)
+            self.save_link_view(view)
+
+    def _read_text(self, path: Path) -> str:
+        with self.fs.open(path, "r", encoding="utf-8") as f:
+            return f.read()
+
+
+class BatchWriter:
+    """
+    Appends entries of one batch to <batch_id>.json and moves.csv as they
+    arrive, so callers never need the whole batch in memory. The JSON file is
+    a plain array, one entry per line, written in place (batch ids are
+    unique, so no other run touches it) and synced after every chunk: a run
+    killed part-way still leaves every logged entry undoable, just without
+    the closing bracket. It is written before moves.csv, so anything the
+    history lists can be undone. CSV rows (and the per-extension index rows
+    of file moves and undos) go out under one lock per chunk so concurrent
+    runs never interleave lines. With batch_file=False only the history is
+    written (see MoveLogger.open_undo).
+    """
+    def __init__(self, logger: MoveLogger, batch_id: str, batch_file: bool = True):
+        self.logger = logger
+        self.batch_id = batch_id
+        self.batch_file = batch_file
+        self.count = 0
+        self.path = logger.meta_dir / f"{batch_id}.json"
+        self._json = None
+        self._has_links = False
+
+    def __enter__(self) -> "BatchWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def write(self, entries: Iterable[MoveLogEntry]) -> None:
+        rows = []
+        by_ext: Dict[str, List[MoveLogEntry]] = {}
+        for e in entries:
+            item = {"src": str(e.src), "dst": str(e.dst), "timestamp": e.timestamp.isoformat(),
+                    "action": e.action}
+            rows.append(([e.batch_id, str(e.src), str(e.dst), e.timestamp.isoformat(), e.action],
+                         json.dumps(item)))
+            if e.action in ("move", "undo"):
+                by_ext.setdefault(e.dst.suffix.lower(), []).append(e)
+            elif e.action != "rmdir":
+                self._has_links = True
+        if not rows:
+            return
+
+        fs = self.logger.fs
+        if self.batch_file:
+            if self._json is None:
+                self._json = fs.open(self.path, "w", encoding="utf-8")
+                self._json.write("[\n")
+            for _, line in rows:
+                self._json.write((",\n" if self.count else "") + line)
+                self.count += 1
+            fs.fsync(self._json)
+
+        text = _csv_text(row for row, _ in rows)
+        if by_ext:
+            self.logger.ensure_index()  # before lock(): FileLock is not reentrant
+        with self.logger.lock():
+            with fs.open(self.logger.csv_path, "a", encoding="utf-8", newline="") as f:
+                f.write(text)
+            for ext, group in by_ext.items():
+                self.logger._append_index(ext, group)
+
+    def close(self) -> None:
+        if self._json is None:
+            return
+        self._json.write("\n]\n")
+        self.logger.fs.fsync(self._json)
+        self._json.close()
+        self._json = None
+        # Link views are small relative to the tree; fold them in once at the end
+        if self._has_links:
+            self.logger.apply_to_link_view(self.logger.iter_batch(self.batch_id))
+
+
+def _index_name(ext: str) -> str:
+    """File under index/ for one extension; odd extensions are hashed."""
+    key = ext.lstrip(".")
+    if not key:
+        return "_noext.csv"
+    if key.isascii() and key.isalnum():
+        return f"{key}.csv"
+    return "_" + hashlib.sha1(ext.encode("utf-8", "surrogateescape")).hexdigest()[:16] + ".csv"
+
+
+def _csv_text(rows: Iterable[list]) -> str:
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    return buf.getvalue()
+
+
+def _iter_json_array(fs: FileSystem, path: Path, reverse: bool = False) -> Iterator[dict]:
+    """
+    Yield items of a batch JSON file. Files written by BatchWriter hold one
+    item per line and are streamed (backwards too, a block at a time); a run
+    that was killed leaves no closing bracket and maybe a cut-off last line,
+    which is skipped. Older indented files are loaded whole.
+    """
+    with fs.open(path, "rb") as f:
+        first = f.readline()
+        start = f.tell()
+        second = f.readline().strip().rstrip(b",")
+        at_end = not f.read(1)
+        if first.strip() != b"[" or not (second in (b"", b"]") or second.endswith(b"}") or at_end):
+            # Not our line-per-item layout (e.g. indent=2)
+            f.seek(0)
+            items = json.loads(f.read())
+            yield from reversed(items) if reverse else items
+            return
+        f.seek(start)
+        for line in _iter_lines_reversed(f, start) if reverse else f:
+            line = line.strip().rstrip(b",")
+            if not line.startswith(b"{"):
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                continue  # only the last line can be cut off
+            yield item
+
+
+def _iter_lines_reversed(f, start: int, block_size: int = 1 << 16) -> Iterator[bytes]:
+    """Lines of binary file f after offset start, last line first, one block in memory."""
+    pos = f.seek(0, os.SEEK_END)
+    tail = b""
+    while pos > start:
+        size = min(block_size, pos - start)
+        pos -= size
+        f.seek(pos)
+        lines = (f.read(size) + tail).split(b"\n")
+        tail = lines[0]
+        yield from reversed(lines[1:])
+    yield tail
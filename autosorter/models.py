@@ -16,6 +16,7 @@ class MoveResult:
     dst: Path
     performed: bool  # False if dry-run
     reason: str = ""  # e.g., "exists, renamed", "skipped same location"
+    action: str = "move"  # "move", "hardlink", "reflink", "symlink", "unlink" or "rmdir"
 
 
 @dataclass(frozen=True)
@@ -23,4 +24,5 @@ class MoveLogEntry:
     batch_id: str
     src: Path
     dst: Path
-    timestamp: datetime
\ No newline at end of file
+    timestamp: datetime
+    action: str = "move"
@@ -1,47 +1,252 @@
 from pathlib import Path
-from typing import List, Tuple
-import shutil
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
+from .filesystem import FileSystem, LOCAL_FS
+from .locking import DestinationLocks
 from .models import FileRecord, MoveResult
+from .throttle import Throttle
 from .utils import unique_path
 
+LAST_COPY_REASON = "last copy of removed source, kept"
+REPLACED_REASON = "link path now holds something else, kept"
+
+
+def is_last_copy(fs: FileSystem, src: Path, link_path: Path, action: str) -> bool:
+    """True if removing link_path would delete data that exists nowhere else."""
+    try:
+        if action == "hardlink":
+            return fs.lstat(link_path).st_nlink <= 1
+        if action == "reflink":
+            # A clone is an independent copy; with the source gone it is the only one
+            return fs.exists(link_path) and not fs.exists(src)
+    except OSError:
+        pass
+    return False
+
+
+def link_replaced(fs: FileSystem, src: Path, link_path: Path, action: str) -> bool:
+    """
+    True if link_path is no longer the link made from src, e.g. the name was
+    freed and reused. A missing link_path is not "replaced".
+    """
+    try:
+        if not fs.lexists(link_path):
+            return False
+        if action == "symlink":
+            return not fs.is_symlink(link_path) or fs.readlink(link_path) != src
+        if fs.is_symlink(link_path):
+            return True
+        if action == "hardlink" and fs.exists(src):
+            return not fs.samefile(src, link_path)
+    except OSError:
+        return True  # can't tell; keeping it is the safe side
+    return False
+
+
+def _error_reason(e: OSError) -> str:
+    return f"perm-denied: {e}" if isinstance(e, PermissionError) else f"os-error: {e}"
+
+
+def _in_scan(path: Path, root: Path, recursive: bool) -> bool:
+    """Whether scanning root (recursively or not) would have listed path."""
+    return root in path.parents if recursive else path.parent == root
+
+
 class SafeMover:
-    def __init__(self, output_root: Path, dry_run: bool = True):
+    """
+    Moves files into <output_root>/<subfolder>. With link=True the sources
+    are left in place and the organized view is built from links instead.
+    """
+    def __init__(self, output_root: Path, dry_run: bool = True, link: bool = False,
+                 fs: Optional[FileSystem] = None, locks: Optional[DestinationLocks] = None,
+                 throttle: Optional[Throttle] = None):
         self.output_root = output_root
         self.dry_run = dry_run
+        self.link = link
+        self.fs = fs or LOCAL_FS
+        self.throttle = throttle
+        self._dest_dev: Optional[int] = None
+        # Other sorter processes may target the same folders; hold a
+        # per-folder lock from picking a free name until the file lands.
+        if locks is None and not dry_run:
+            locks = DestinationLocks(output_root, self.fs)
+        self.locks = locks
 
     def move_one(self, rec: FileRecord, subfolder: str) -> MoveResult:
-        # Build destination folder and file path
+        if self.dry_run:
+            return self._locked_place(rec, subfolder, 0)
+        nbytes = self._io_bytes(rec)
+        if self.throttle is None:
+            return self._locked_place(rec, subfolder, nbytes)
+        # Wait for tokens before taking the folder lock so other runs aren't held up
+        with self.throttle.op(nbytes):
+            return self._locked_place(rec, subfolder, nbytes)
+
+    def _io_bytes(self, rec: FileRecord) -> int:
+        """Bytes a move really copies: links and same-device renames copy none."""
+        if self.link:
+            return 0
+        try:
+            if self._dest_dev is None:
+                self._dest_dev = self.fs.stat(self.output_root).st_dev
+            return 0 if self.fs.stat(rec.path).st_dev == self._dest_dev else rec.size
+        except OSError:
+            return rec.size
+
+    def _locked_place(self, rec: FileRecord, subfolder: str, nbytes: int) -> MoveResult:
+        if self.locks is None:
+            return self._place(rec, subfolder)
         dest_dir = self.output_root / subfolder
-        dest_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            lock = self.locks.folder(dest_dir)
+            lock.acquire()
+        except OSError as e:
+            return MoveResult(rec.path, dest_dir / rec.name, performed=False, reason=f"lock-failed: {e}")
+        try:
+            if self.link or not nbytes:
+                # Links and same-device renames are quick; finish under the lock
+                return self._place(rec, subfolder)
+            # A cross-device move copies the whole file. Reserve the name with
+            # an empty placeholder and let other runs into the folder meanwhile.
+            dest_file, reason = self._target(dest_dir, rec)
+            try:
+                self.fs.mkdir(dest_dir)
+                self.fs.create_new(dest_file)
+            except OSError as e:
+                return MoveResult(rec.path, dest_file, performed=False, reason=_error_reason(e))
+        finally:
+            lock.release()
+        res = self._move(rec, dest_file, reason)
+        if not res.performed:
+            try:
+                self.fs.unlink(dest_file)  # placeholder, or a partial copy
+            except OSError:
+                pass
+        return res
 
+    def _target(self, dest_dir: Path, rec: FileRecord) -> Tuple[Path, str]:
+        """Free destination name for rec in dest_dir, and why it was renamed."""
         dest_file = dest_dir / rec.name
+        if self.fs.lexists(dest_file):
+            return unique_path(dest_file, self.fs), "exists, renamed"
+        return dest_file, ""
 
-        if dest_file.exists():
-            dest_file = unique_path(dest_file)
-            reason = "exists, renamed"
-        else:
-            reason = ""
+    def _place(self, rec: FileRecord, subfolder: str) -> MoveResult:
+        # Build destination folder and file path
+        dest_dir = self.output_root / subfolder
+        dest_file, reason = self._target(dest_dir, rec)
 
         # Skip if source and destination are same
         if rec.path == dest_file:
             return MoveResult(rec.path, dest_file, performed=False, reason="same location")
 
+        action = "link" if self.link else "move"
         if self.dry_run:
-            return MoveResult(rec.path, dest_file, performed=False, reason=reason)
+            return MoveResult(rec.path, dest_file, performed=False, reason=reason, action=action)
+
+        if self.link:
+            try:
+                self.fs.mkdir(dest_dir)
+                action = self.fs.make_link(rec.path, dest_file)
+            except OSError as e:
+                return MoveResult(rec.path, dest_file, performed=False, reason=f"os-error: {e}", action=action)
+            return MoveResult(rec.path, dest_file, performed=True, reason=reason, action=action)
 
         # Real move
-        dest_file.parent.mkdir(parents=True, exist_ok=True)
         try:
-            shutil.move(str(rec.path), str(dest_file))
-        except PermissionError as e:
-            return MoveResult(rec.path, dest_file, performed=False, reason=f"perm-denied: {e}")
+            self.fs.mkdir(dest_dir)
         except OSError as e:
-            return MoveResult(rec.path, dest_file, performed=False, reason=f"os-error: {e}")
+            return MoveResult(rec.path, dest_file, performed=False, reason=_error_reason(e))
+        return self._move(rec, dest_file, reason)
 
+    def _move(self, rec: FileRecord, dest_file: Path, reason: str) -> MoveResult:
+        try:
+            self.fs.move(rec.path, dest_file)
+        except OSError as e:
+            return MoveResult(rec.path, dest_file, performed=False, reason=_error_reason(e))
+        return MoveResult(rec.path, dest_file, performed=True, reason=reason)
 
     def move_many(self, pairs: List[Tuple[FileRecord, str]]) -> List[MoveResult]:
         results: List[MoveResult] = []
         for rec, folder in pairs:
             results.append(self.move_one(rec, folder))
         return results
+
+    def iter_move(self, pairs: Iterable[Tuple[FileRecord, str]]) -> Iterator[MoveResult]:
+        """Lazy version of move_many(); results are not accumulated."""
+        for rec, folder in pairs:
+            yield self.move_one(rec, folder)
+
+    def sync_links(self, pairs: Iterable[Tuple[FileRecord, str]],
+                   view: Dict[Path, Tuple[Path, str]], source_root: Path,
+                   recursive: bool = True) -> Iterator[MoveResult]:
+        """
+        Bring an existing link view (src -> (link path, action)) in line with
+        the current plan, lazily. Only new, re-classified or stale entries get
+        a link created; links whose source vanished from the plan are removed,
+        unless the link is now the only copy of the data (reported with
+        LAST_COPY_REASON instead). Unchanged entries produce no result.
+
+        The view may hold links from other sources (or from a recursive run
+        when this one is not); only entries the scan of source_root could
+        have seen count as vanished. The rest are left alone.
+
+        Entries are popped from view as the plan matches them, so what is left
+        at the end are the vanished sources; pass a fresh copy each time.
+        """
+        # A view inside the source tree gets rescanned; never link our own links
+        own_links = {link_path for link_path, _ in view.values()}
+        for rec, folder in pairs:
+            if rec.path in own_links:
+                continue
+            current = view.pop(rec.path, None)
+            if current is not None:
+                link_path, action = current
+                if self._link_is_current(rec, folder, link_path, action):
+                    continue
+                yield self._remove_link(rec.path, link_path, action)
+            yield self.move_one(rec, folder)
+
+        for src, (link_path, action) in view.items():
+            if not _in_scan(src, source_root, recursive):
+                continue
+            if is_last_copy(self.fs, src, link_path, action):
+                yield MoveResult(src, link_path, performed=False, reason=LAST_COPY_REASON, action="unlink")
+                continue
+            yield self._remove_link(src, link_path, action)
+
+    def _link_is_current(self, rec: FileRecord, folder: str, link_path: Path, action: str) -> bool:
+        if link_path.parent != self.output_root / folder:
+            return False
+        try:
+            st = self.fs.lstat(link_path)
+        except OSError:
+            return False
+        if action == "reflink":
+            # Clones are independent copies; refresh when the source changed
+            return st.st_mtime >= rec.mtime.timestamp() and st.st_size == rec.size
+        if action == "hardlink":
+            # Source may have been replaced by a new inode since we linked it
+            try:
+                return self.fs.samefile(rec.path, link_path)
+            except OSError:
+                return False
+        return self.fs.exists(link_path)
+
+    def _remove_link(self, src: Path, link_path: Path, action: str) -> MoveResult:
+        if link_replaced(self.fs, src, link_path, action):
+            return MoveResult(src, link_path, performed=False, reason=REPLACED_REASON, action="unlink")
+        if self.dry_run:
+            return MoveResult(src, link_path, performed=False, action="unlink")
+        try:
+            if self.throttle is not None:
+                with self.throttle.op():
+                    self.fs.unlink(link_path)
+            else:
+                self.fs.unlink(link_path)
+        except FileNotFoundError:
+            return MoveResult(src, link_path, performed=False, reason="link already gone", action="unlink")
+        except OSError as e:
+            return MoveResult(src, link_path, performed=False, reason=f"os-error: {e}", action="unlink")
+        # Remember how it was made so undo can put it back the same way
+        return MoveResult(src, link_path, performed=True, reason=action, action="unlink")
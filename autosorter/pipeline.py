@@ -0,0 +1,260 @@
+import itertools
+import json
+import os
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .classifier import Classifier
+from .cleanup import EmptyDirCollapser
+from .filesystem import FileSystem, LOCAL_FS
+from .logger import MoveLogger
+from .models import FileRecord, MoveLogEntry, MoveResult
+from .mover import SafeMover
+from .throttle import Throttle
+
+DEFAULT_MEMORY_LIMIT_MB = 64
+# Rough in-memory cost of one (FileRecord, folder) pair incl. Path/datetime objects
+APPROX_PAIR_BYTES = 1024
+# Moves between log syncs: at most this many go unrecorded if the process dies
+LOG_EVERY = 256
+
+_spill_ids = itertools.count()
+
+
+def chunk_size_for(memory_limit_mb: int) -> int:
+    return max(1, memory_limit_mb * 1024 * 1024 // APPROX_PAIR_BYTES)
+
+
+class PlanStore:
+    """
+    Holds the (FileRecord, folder) plan. Pairs stay in memory until the
+    buffer reaches chunk_size, after which they are spilled to a temporary
+    JSON-lines file in spill_dir (the system temp dir if not given) on fs.
+    Iteration replays the file, then the buffer.
+    """
+    def __init__(self, chunk_size: int, spill_dir: Optional[Path] = None,
+                 fs: Optional[FileSystem] = None):
+        self.chunk_size = chunk_size
+        self.spill_dir = spill_dir or Path(tempfile.gettempdir())
+        self.fs = fs or LOCAL_FS
+        self.spill_path: Optional[Path] = None
+        self._buffer: List[Tuple[FileRecord, str]] = []
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __enter__(self) -> "PlanStore":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def add(self, rec: FileRecord, folder: str) -> None:
+        self._buffer.append((rec, folder))
+        self._count += 1
+        if len(self._buffer) >= self.chunk_size:
+            self._spill()
+
+    def extend(self, pairs: Iterable[Tuple[FileRecord, str]]) -> None:
+        for rec, folder in pairs:
+            self.add(rec, folder)
+
+    def __iter__(self) -> Iterator[Tuple[FileRecord, str]]:
+        if self.spill_path is not None:
+            with self.fs.open(self.spill_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    yield _decode_pair(line)
+        yield from self._buffer
+
+    def iter_chunks(self) -> Iterator[List[Tuple[FileRecord, str]]]:
+        chunk: List[Tuple[FileRecord, str]] = []
+        for pair in self:
+            chunk.append(pair)
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def head(self, n: int) -> List[Tuple[FileRecord, str]]:
+        out: List[Tuple[FileRecord, str]] = []
+        for pair in self:
+            if len(out) >= n:
+                break
+            out.append(pair)
+        return out
+
+    def close(self) -> None:
+        self._buffer = []
+        if self.spill_path is not None:
+            try:
+                self.fs.unlink(self.spill_path)
+            except OSError:
+                pass
+            self.spill_path = None
+
+    def _spill(self) -> None:
+        if self.spill_path is None:
+            self.fs.mkdir(self.spill_dir)
+            while self.spill_path is None:
+                path = self.spill_dir / f"autosorter-plan-{os.getpid()}-{next(_spill_ids)}.jsonl"
+                try:
+                    self.fs.create_new(path)
+                    self.spill_path = path
+                except FileExistsError:
+                    pass  # left by a killed run with the same pid
+        with self.fs.open(self.spill_path, "a", encoding="utf-8") as f:
+            for rec, folder in self._buffer:
+                f.write(_encode_pair(rec, folder) + "\n")
+        self._buffer = []
+
+
+class OrganizePipeline:
+    """
+    Scan → classify → move → log in fixed-size chunks. Peak memory is bounded
+    by the chunk size derived from memory_limit_mb, not by the tree size.
+    In link-farm mode the one exception is the existing link view
+    (links.json), which is held in memory while it is diffed.
+
+    The plan spills to dest_root/.autosorter unless spill_dir says otherwise;
+    the system temp dir is often tmpfs, i.e. RAM again.
+    """
+    def __init__(self, dest_root: Path, classifier: Classifier,
+                 memory_limit_mb: int = DEFAULT_MEMORY_LIMIT_MB,
+                 fs: Optional[FileSystem] = None, throttle: Optional[Throttle] = None,
+                 spill_dir: Optional[Path] = None):
+        self.dest_root = dest_root
+        self.classifier = classifier
+        self.chunk_size = chunk_size_for(memory_limit_mb)
+        self.fs = fs or LOCAL_FS
+        self.throttle = throttle
+        self.spill_dir = spill_dir or dest_root / ".autosorter"
+
+    def plan(self, files: Iterable[FileRecord]) -> PlanStore:
+        """Classify a stream of records into a (possibly disk-backed) PlanStore."""
+        store = PlanStore(self.chunk_size, self.spill_dir, self.fs)
+        store.extend(self.classifier.iter_assign(files))
+        return store
+
+    def preview(self, plan: PlanStore, limit: int) -> List[MoveResult]:
+        """Dry-run only the first `limit` pairs of the plan."""
+        return SafeMover(self.dest_root, dry_run=True, fs=self.fs).move_many(plan.head(limit))
+
+    def execute(self, plan: PlanStore, batch_id: str,
+                on_result: Optional[Callable[[MoveResult], None]] = None,
+                should_stop: Optional[Callable[[], bool]] = None,
+                on_progress: Optional[Callable[[int, int], None]] = None,
+                logger: Optional[MoveLogger] = None,
+                collapse_root: Optional[Path] = None) -> int:
+        """
+        Perform the real moves chunk by chunk, logging every LOG_EVERY moves
+        as they finish. Returns the number of files moved.
+
+        With collapse_root set, directories under it that the moves left
+        empty are removed afterwards and logged as rmdir entries.
+        """
+        mover = SafeMover(self.dest_root, dry_run=False, fs=self.fs, throttle=self.throttle)
+        logger = logger or MoveLogger(self.dest_root, self.fs)
+        if self.throttle is not None:
+            self.throttle.apply_priority()
+        total = len(plan)
+        done = 0
+        moved = 0
+        touched: Set[Path] = set()
+        # Recorded up front: a killed run's files must still be found by a re-sort
+        logger.record_rules(batch_id, self.classifier.rules.map)
+        with logger.open_batch(batch_id) as writer:
+            for chunk in plan.iter_chunks():
+                entries: List[MoveLogEntry] = []
+                for res in mover.iter_move(chunk):
+                    done += 1
+                    if res.performed:
+                        entries.append(MoveLogEntry(batch_id, res.src, res.dst, datetime.now(), res.action))
+                        touched.add(res.src.parent)
+                        if on_result:
+                            on_result(res)
+                    if on_progress:
+                        on_progress(done, total)
+                    if len(entries) >= LOG_EVERY:
+                        writer.write(entries)
+                        moved += len(entries)
+                        entries = []
+                    if should_stop and should_stop():
+                        break
+                writer.write(entries)
+                moved += len(entries)
+                if should_stop and should_stop():
+                    break
+
+            if collapse_root is not None and touched:
+                collapser = EmptyDirCollapser(collapse_root, fs=self.fs)
+                writer.write(
+                    MoveLogEntry(batch_id, r.src, r.dst, datetime.now(), r.action)
+                    for r in collapser.collapse(touched)
+                )
+
+        if not moved:
+            logger.forget_rules(batch_id)
+        return moved
+
+    def preview_links(self, plan: PlanStore, limit: int, source_root: Path, recursive: bool = True,
+                      logger: Optional[MoveLogger] = None) -> Tuple[List[MoveResult], int]:
+        """
+        Dry-run a link sync: the first `limit` changes plus how many there are
+        in all. source_root/recursive describe the scan that built the plan.
+        """
+        logger = logger or MoveLogger(self.dest_root, self.fs)
+        mover = SafeMover(self.dest_root, dry_run=True, link=True, fs=self.fs)
+        previews: List[MoveResult] = []
+        total = 0
+        for res in mover.sync_links(plan, logger.load_link_view(), source_root, recursive):
+            if total < limit:
+                previews.append(res)
+            total += 1
+        return previews, total
+
+    def execute_links(self, plan: PlanStore, batch_id: str, source_root: Path, recursive: bool = True,
+                      on_result: Optional[Callable[[MoveResult], None]] = None,
+                      should_stop: Optional[Callable[[], bool]] = None,
+                      logger: Optional[MoveLogger] = None) -> int:
+        """
+        Link-farm counterpart of execute(): sync the link view with the plan,
+        logging changes chunk by chunk. on_result sees every result, including
+        links kept because they hold the last copy. Returns the number of link
+        changes applied.
+        """
+        mover = SafeMover(self.dest_root, dry_run=False, link=True, fs=self.fs, throttle=self.throttle)
+        logger = logger or MoveLogger(self.dest_root, self.fs)
+        if self.throttle is not None:
+            self.throttle.apply_priority()
+        applied = 0
+        with logger.open_batch(batch_id) as writer:
+            entries: List[MoveLogEntry] = []
+            for res in mover.sync_links(plan, logger.load_link_view(), source_root, recursive):
+                if res.performed:
+                    entries.append(MoveLogEntry(batch_id, res.src, res.dst, datetime.now(), res.action))
+                if on_result:
+                    on_result(res)
+                if len(entries) >= LOG_EVERY:
+                    writer.write(entries)
+                    applied += len(entries)
+                    entries = []
+                if should_stop and should_stop():
+                    break
+            writer.write(entries)
+            applied += len(entries)
+        return applied
+
+
+def _encode_pair(rec: FileRecord, folder: str) -> str:
+    return json.dumps([str(rec.path), rec.name, rec.ext, rec.size, rec.mtime.timestamp(), folder])
+
+
+def _decode_pair(line: str) -> Tuple[FileRecord, str]:
+    path, name, ext, size, mtime, folder = json.loads(line)
+    rec = FileRecord(path=Path(path), name=name, ext=ext, size=size,
+                     mtime=datetime.fromtimestamp(mtime))
+    return rec, folder
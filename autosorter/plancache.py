@@ -0,0 +1,91 @@
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from .classifier import Classifier, RuleSet
+from .filesystem import FileSystem, LOCAL_FS
+from .models import FileRecord, MoveResult
+from .pipeline import DEFAULT_MEMORY_LIMIT_MB, OrganizePipeline, PlanStore
+from .scanner import FolderScanner
+
+
+class PlanKey(NamedTuple):
+    source: Path
+    dest_root: Path
+    rules_path: Optional[Path]
+    recursive: bool
+
+
+class CachedPlan:
+    """
+    A finished scan + classification plus its dry-run preview, along with a
+    fingerprint taken before the scan: the mtime of every scanned directory
+    (files added, removed or renamed bump it), of every category folder the
+    rules can target (their contents decide conflict renames in the
+    preview) and of the rules file. Checking freshness stats directories
+    only, never files.
+    """
+    def __init__(self, key: PlanKey, plan: PlanStore, previews: List[MoveResult],
+                 fingerprint: Dict[Path, float], fs: Optional[FileSystem] = None):
+        self.key = key
+        self.plan = plan
+        self.previews = previews
+        self.fingerprint = fingerprint
+        self.fs = fs or LOCAL_FS
+
+    def is_fresh(self) -> bool:
+        return take_fingerprint(self.key, self.fs) == self.fingerprint
+
+    def close(self) -> None:
+        self.plan.close()
+
+
+def take_fingerprint(key: PlanKey, fs: Optional[FileSystem] = None) -> Dict[Path, float]:
+    fs = fs or LOCAL_FS
+    stamps: Dict[Path, float] = {}
+    try:
+        for d in fs.iter_dirs(key.source, key.recursive):
+            stamps[d] = fs.stat(d).st_mtime
+        if key.dest_root != key.source:
+            stamps[key.dest_root] = fs.stat(key.dest_root).st_mtime
+        # Category folders decide conflict renames in the preview
+        for folder in sorted(RuleSet(key.rules_path).folders()):
+            d = key.dest_root / folder
+            try:
+                stamps[d] = fs.stat(d).st_mtime
+            except FileNotFoundError:
+                stamps[d] = 0.0  # not created yet; creating it changes the stamp
+        if key.rules_path is not None:
+            stamps[key.rules_path] = fs.stat(key.rules_path).st_mtime
+    except (OSError, ValueError):
+        stamps[key.source] = -1.0  # unreadable: never matches a later check
+    return stamps
+
+
+def build_plan(key: PlanKey, memory_limit_mb: int = DEFAULT_MEMORY_LIMIT_MB,
+               preview_limit: int = 50, fs: Optional[FileSystem] = None,
+               cancelled: Optional[Callable[[], bool]] = None) -> Optional[CachedPlan]:
+    """
+    Scan, classify and preview for key. Returns None if cancelled() turned
+    true part-way (the partial plan is discarded).
+    """
+    fs = fs or LOCAL_FS
+    fingerprint = take_fingerprint(key, fs)
+    scanner = FolderScanner(key.source, recursive=key.recursive, fs=fs)
+    pipeline = OrganizePipeline(key.dest_root, Classifier(RuleSet(key.rules_path)), memory_limit_mb, fs=fs)
+
+    stopped = [False]
+    plan = pipeline.plan(_until(scanner.iter_files(), cancelled, stopped))
+    if stopped[0]:
+        plan.close()
+        return None
+    return CachedPlan(key, plan, pipeline.preview(plan, preview_limit), fingerprint, fs)
+
+
+def _until(files: Iterable[FileRecord], cancelled: Optional[Callable[[], bool]],
+           stopped: List[bool]) -> Iterator[FileRecord]:
+    for i, rec in enumerate(files):
+        # Checking every record would dominate a fast scan
+        if cancelled is not None and i % 256 == 0 and cancelled():
+            stopped[0] = True
+            return
+        yield rec
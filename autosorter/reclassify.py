@@ -0,0 +1,74 @@
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .classifier import RuleSet
+from .filesystem import FileSystem, LOCAL_FS
+from .logger import MoveLogger
+from .models import FileRecord
+
+
+class Reclassifier:
+    """
+    Finds already-organized files whose target folder changed, without
+    rescanning the archive. Every batch records the rules it sorted by, so
+    files placed by older rule versions are still found; undoing a batch
+    drops its record. The per-extension history index is the reverse
+    index: only the changed extensions' rows are read, and each file is
+    followed through later re-sorts and undos to its latest location.
+    """
+    def __init__(self, dest_root: Path, logger: MoveLogger, fs: Optional[FileSystem] = None):
+        self.dest_root = dest_root
+        self.logger = logger
+        self.fs = fs or LOCAL_FS
+
+    def changes(self, new_rules: RuleSet) -> Dict[str, Tuple[Set[str], str]]:
+        """Extension -> (folders recorded rule versions chose, folder new_rules choose)."""
+        changed: Dict[str, Tuple[Set[str], str]] = {}
+        for mapping in self.logger.load_rule_versions():
+            for ext, (old, new) in new_rules.diff(RuleSet.from_mapping(mapping)).items():
+                changed.setdefault(ext, (set(), new))[0].add(old)
+        return changed
+
+    def affected_index(self, exts: Iterable[str]) -> Dict[Path, str]:
+        """
+        Current path -> extension for organized files with one of exts.
+        Reads the whole history of those extensions (and nothing else) under
+        the shared log lock; the first call on an older root builds the index
+        from moves.csv once.
+        """
+        exts: List[str] = sorted(set(exts))
+        self.logger.ensure_index()
+        index: Dict[Path, str] = {}
+        with self.logger.lock(exclusive=False):
+            for ext in exts:
+                for e in self.logger.iter_index(ext):
+                    index.pop(e.src, None)  # moved again or undone later
+                    index[e.dst] = ext
+        return index
+
+    def iter_affected(self, new_rules: RuleSet) -> Iterator[FileRecord]:
+        """
+        Yield records for organized files still sitting in a folder an
+        earlier rule version chose and that new_rules send elsewhere. Feed
+        them to Classifier(new_rules) / OrganizePipeline.plan to get the moves.
+        """
+        changed = self.changes(new_rules)
+        if not changed:
+            return
+        old_dirs = {ext: {self.dest_root / f for f in old} for ext, (old, _) in changed.items()}
+        for path, ext in self.affected_index(changed).items():
+            # Skip files that were undone, moved by hand or deleted since
+            if path.parent not in old_dirs[ext]:
+                continue
+            try:
+                stat = self.fs.stat(path)
+            except OSError:
+                continue
+            yield FileRecord(
+                path=path,
+                name=path.name,
+                ext=ext,
+                size=stat.st_size,
+                mtime=datetime.fromtimestamp(stat.st_mtime),
+            )
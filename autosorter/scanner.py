@@ -1,38 +1,33 @@
 from pathlib import Path
 from datetime import datetime
-from typing import Iterable, List
+from typing import Iterator, List, Optional
+from .filesystem import FileSystem, LOCAL_FS
 from .models import FileRecord
 
 class FolderScanner:
     """Scans a folder (optionally recursively) and yields FileRecord objects."""
 
-    def __init__(self, root: Path, recursive: bool = True, ignore_hidden: bool = True):
+    def __init__(self, root: Path, recursive: bool = True, ignore_hidden: bool = True,
+                 fs: Optional[FileSystem] = None):
         self.root = root
         self.recursive = recursive
         self.ignore_hidden = ignore_hidden
+        self.fs = fs or LOCAL_FS
 
-    def scan(self) -> List[FileRecord]:
-        paths: Iterable[Path]
-        if self.recursive:
-            paths = self.root.rglob("*")
-        else:
-            paths = self.root.glob("*")
-
-        files: List[FileRecord] = []
-        for p in paths:
-            if not p.is_file():
-                continue
+    def iter_files(self) -> Iterator[FileRecord]:
+        """Yield FileRecord objects one at a time without building a list."""
+        for p in self.fs.iter_files(self.root, self.recursive):
             if self.ignore_hidden and any(part.startswith('.') for part in p.parts):
                 continue
 
-            stat = p.stat()
-            files.append(
-                FileRecord(
-                    path=p,
-                    name=p.name,
-                    ext=p.suffix.lower(),
-                    size=stat.st_size,
-                    mtime=datetime.fromtimestamp(stat.st_mtime),
-                )
+            stat = self.fs.stat(p)
+            yield FileRecord(
+                path=p,
+                name=p.name,
+                ext=p.suffix.lower(),
+                size=stat.st_size,
+                mtime=datetime.fromtimestamp(stat.st_mtime),
             )
-        return files
+
+    def scan(self) -> List[FileRecord]:
+        return list(self.iter_files())
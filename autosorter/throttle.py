@@ -0,0 +1,181 @@
+import ctypes
+import ctypes.util
+import json
+import platform
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+from .utils import atomic_write_text, lower_thread_priority
+
+CONTROL_NAME = "throttle.json"
+CONTROL_CHECK_INTERVAL = 1.0  # seconds between looks at the control file
+MAX_BACKOFF = 2.0  # seconds of extra delay per op at most
+
+# ioprio_set(2) syscall numbers; other architectures simply skip idle I/O
+_IOPRIO_SET_NR: Dict[str, int] = {"x86_64": 251, "aarch64": 30, "i686": 289, "i386": 289,
+                                   "armv7l": 314, "ppc64le": 273, "s390x": 282}
+_IOPRIO_WHO_PROCESS = 1  # with a thread id this targets just that thread
+_IOPRIO_CLASS_IDLE = 3
+_IOPRIO_CLASS_SHIFT = 13
+
+
+class TokenBucket:
+    """
+    Classic token bucket; a rate <= 0 means unlimited. Tokens may go
+    negative (a file bigger than the burst), which just makes the next
+    callers wait longer. The rate can be changed while others are waiting.
+    """
+    def __init__(self, rate: float = 0.0, burst: Optional[float] = None):
+        self._lock = threading.Lock()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate: float, burst: Optional[float] = None) -> None:
+        with self._lock:
+            self.rate = float(rate)
+            self.burst = float(burst) if burst is not None else max(self.rate, 1.0)
+            self.tokens = self.burst
+            self.stamp = time.monotonic()
+
+    def reserve(self, n: float) -> float:
+        """Take n tokens and return how long the caller must sleep first."""
+        with self._lock:
+            if self.rate <= 0:
+                return 0.0
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= n
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class Throttle:
+    """
+    Rate limits (bytes/sec, ops/sec), adaptive backoff and thread priority
+    for SafeMover/UndoManager. Limits may change at runtime, either directly
+    via set_limits() (GUI) or through a JSON control file that is re-read when
+    it changes (write_control_file(), used by the CLI):
+
+        {"bytes_per_sec": 52428800, "ops_per_sec": 200, "latency_threshold": 0.05}
+
+    When an operation takes longer than latency_threshold seconds, a delay
+    is added before each following op, doubling while latency stays high and
+    halving once it recovers.
+    """
+    def __init__(self, bytes_per_sec: float = 0, ops_per_sec: float = 0,
+                 latency_threshold: float = 0.0, idle_io: bool = False, niceness: int = 0,
+                 control_file: Optional[Path] = None):
+        self.bytes = TokenBucket(bytes_per_sec)
+        self.ops = TokenBucket(ops_per_sec)
+        self.latency_threshold = latency_threshold
+        self.idle_io = idle_io
+        self.niceness = niceness
+        self.control_file = control_file
+        self.backoff = 0.0
+        self._lock = threading.Lock()
+        self._control_mtime: Optional[float] = None
+        self._next_control_check = 0.0
+        # Limits left behind by an earlier run don't override the ones given here
+        if control_file is not None:
+            try:
+                self._control_mtime = control_file.stat().st_mtime
+            except OSError:
+                pass
+
+    def set_limits(self, bytes_per_sec: Optional[float] = None, ops_per_sec: Optional[float] = None,
+                   latency_threshold: Optional[float] = None) -> None:
+        if bytes_per_sec is not None:
+            self.bytes.set_rate(bytes_per_sec)
+        if ops_per_sec is not None:
+            self.ops.set_rate(ops_per_sec)
+        if latency_threshold is not None:
+            with self._lock:
+                self.latency_threshold = latency_threshold
+                if latency_threshold <= 0:
+                    self.backoff = 0.0
+
+    def apply_priority(self) -> None:
+        """Lower CPU and I/O priority of the calling (worker) thread, if configured."""
+        if self.niceness > 0:
+            lower_thread_priority(self.niceness)
+        if self.idle_io:
+            set_idle_io_priority()
+
+    @contextmanager
+    def op(self, nbytes: int = 0) -> Iterator[None]:
+        """Wrap one filesystem operation: wait for tokens, then time it."""
+        self._check_control_file()
+        wait = max(self.ops.reserve(1), self.bytes.reserve(nbytes)) + self.backoff
+        if wait > 0:
+            time.sleep(wait)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._record_latency(time.monotonic() - start)
+
+    def _record_latency(self, elapsed: float) -> None:
+        with self._lock:
+            if self.latency_threshold <= 0:
+                return
+            if elapsed > self.latency_threshold:
+                self.backoff = min(MAX_BACKOFF, max(self.backoff * 2, self.latency_threshold))
+            elif self.backoff:
+                self.backoff = self.backoff / 2 if self.backoff > 0.001 else 0.0
+
+    def _check_control_file(self) -> None:
+        if self.control_file is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_control_check:
+                return
+            self._next_control_check = now + CONTROL_CHECK_INTERVAL
+        try:
+            mtime = self.control_file.stat().st_mtime
+        except OSError:
+            return
+        if mtime == self._control_mtime:
+            return
+        self._control_mtime = mtime
+        try:
+            data = json.loads(self.control_file.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return  # half-written or bad file: keep current limits
+        self.set_limits(data.get("bytes_per_sec"), data.get("ops_per_sec"),
+                        data.get("latency_threshold"))
+
+
+def control_path(root: Path) -> Path:
+    return root / ".autosorter" / CONTROL_NAME
+
+
+def write_control_file(root: Path, bytes_per_sec: float, ops_per_sec: float,
+                       latency_threshold: float = 0.0) -> Path:
+    """Publish new limits for every run using <root>/.autosorter/throttle.json."""
+    path = control_path(root)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    atomic_write_text(path, json.dumps({
+        "bytes_per_sec": bytes_per_sec,
+        "ops_per_sec": ops_per_sec,
+        "latency_threshold": latency_threshold,
+    }, indent=2))
+    return path
+
+
+def set_idle_io_priority() -> bool:
+    """ioprio_set(IOPRIO_CLASS_IDLE) for the calling thread. Linux only; False elsewhere."""
+    if not sys.platform.startswith("linux"):
+        return False
+    nr = _IOPRIO_SET_NR.get(platform.machine())
+    if nr is None or not hasattr(threading, "get_native_id"):
+        return False
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        prio = _IOPRIO_CLASS_IDLE << _IOPRIO_CLASS_SHIFT
+        return libc.syscall(nr, _IOPRIO_WHO_PROCESS, threading.get_native_id(), prio) == 0
+    except (OSError, AttributeError):
+        return False
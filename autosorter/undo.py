@@ -1,42 +1,181 @@
-from typing import List
+from contextlib import nullcontext
+from typing import Callable, Iterator, List, Optional, Set
 from pathlib import Path
-import shutil
+from datetime import datetime
 
-from .logger import MoveLogger
+from .filesystem import FileSystem, LOCAL_FS
+from .locking import DestinationLocks
+from .logger import BatchWriter, MoveLogger
 from .models import MoveLogEntry, MoveResult
+from .mover import LAST_COPY_REASON, REPLACED_REASON, is_last_copy, link_replaced
+from .pipeline import LOG_EVERY
+from .throttle import Throttle
 from .utils import unique_path
 
+VIEW_CHUNK = 4096  # link view changes folded into links.json at a time
+
+
 class UndoManager:
-    def __init__(self, root: Path, logger: MoveLogger, dry_run: bool = True):
+    def __init__(self, root: Path, logger: MoveLogger, dry_run: bool = True,
+                 fs: Optional[FileSystem] = None, throttle: Optional[Throttle] = None):
         self.root = root
         self.logger = logger
         self.dry_run = dry_run
+        self.fs = fs or LOCAL_FS
+        self.throttle = throttle
+
+    def undo_batch(self, batch_id: str, on_result: Optional[Callable[[MoveResult], None]] = None) -> int:
+        """Undo a whole batch. Returns the number of entries restored."""
+        restored = 0
+        for res in self.iter_undo(batch_id):
+            if res.performed:
+                restored += 1
+            if on_result:
+                on_result(res)
+        return restored
+
+    def iter_undo(self, batch_id: str) -> Iterator[MoveResult]:
+        """
+        Undo entry by entry, newest first, streaming the batch log backwards;
+        nothing proportional to the batch is kept. A real run holds the batch
+        lock until the iterator is exhausted (or closed), logs every restore
+        as an "undo" row and, once every file is back, drops the batch's
+        rules record so re-sorts stop looking for its layout.
+        """
+        if self.throttle is not None and not self.dry_run:
+            self.throttle.apply_priority()
+        if self.dry_run:
+            yield from self._undo_entries(batch_id)
+            return
+        # Two runs undoing the same batch would fight over every file
+        with DestinationLocks(self.root, self.fs).batch(batch_id), \
+                self.logger.open_undo(batch_id) as history:
+            yield from self._undo_entries(batch_id, history)
+
+    def _undo_entries(self, batch_id: str, history: Optional[BatchWriter] = None) -> Iterator[MoveResult]:
+        view_changes: List[MoveLogEntry] = []
+        restores: List[MoveLogEntry] = []
+        failed = False
+        made: Set[Path] = set()
+        try:
+            # Reverse order to better handle nested moves (not crucial here, but safe).
+            # rmdir entries are logged last, so the collapsed tree comes back first.
+            for e in self.logger.iter_batch(batch_id, reverse=True):
+                if e.action == "rmdir":
+                    if self.dry_run:
+                        yield MoveResult(e.src, e.src, performed=False, action="mkdir")
+                        continue
+                    try:
+                        self._ensure_dir(e.src, made)
+                    except OSError as err:
+                        # e.g. a file now sits where the directory was
+                        yield MoveResult(e.src, e.src, performed=False, reason=_failure(err), action="mkdir")
+                        continue
+                    yield MoveResult(e.src, e.src, performed=True, action="mkdir")
+                    continue
+                if e.action != "move":
+                    res = self._undo_link(e)
+                    if res.performed:
+                        view_changes.append(MoveLogEntry(batch_id, e.src, e.dst, datetime.now(), res.action))
+                        if len(view_changes) >= VIEW_CHUNK:
+                            self.logger.apply_to_link_view(view_changes)
+                            view_changes = []
+                    yield res
+                    continue
+
+                src_now = e.dst
+                dst_restore = e.src
+
+                if not self.fs.exists(src_now):
+                    yield MoveResult(src_now, dst_restore, performed=False, reason="missing source for undo")
+                    continue
 
-    def undo_batch(self, batch_id: str) -> List[MoveResult]:
-        entries: List[MoveLogEntry] = self.logger.load_batch(batch_id)
-        results: List[MoveResult] = []
-        # Reverse order to better handle nested moves (not crucial here, but safe)
-        for e in reversed(entries):
-            src_now = e.dst
-            dst_restore = e.src
-
-            if not src_now.exists():
-                results.append(MoveResult(src_now, dst_restore, performed=False, reason="missing source for undo"))
-                continue
-
-            final_dst = dst_restore
-            if final_dst.exists():
-                final_dst = unique_path(final_dst)
-                reason = "restore name conflict"
-            else:
-                reason = ""
+                final_dst = dst_restore
+                if self.fs.lexists(final_dst):
+                    final_dst = unique_path(final_dst, self.fs)
+                    reason = "restore name conflict"
+                else:
+                    reason = ""
 
+                if self.dry_run:
+                    yield MoveResult(src_now, final_dst, performed=False, reason=reason)
+                    continue
+
+                try:
+                    self._ensure_dir(final_dst.parent, made)
+                    with self._op(self._io_bytes(src_now, final_dst.parent)):
+                        self.fs.move(src_now, final_dst)
+                except OSError as err:
+                    failed = True
+                    yield MoveResult(src_now, final_dst, performed=False, reason=_failure(err))
+                    continue
+                restores.append(MoveLogEntry(batch_id, src_now, final_dst, datetime.now(), "undo"))
+                if len(restores) >= LOG_EVERY:
+                    history.write(restores)
+                    restores = []
+                yield MoveResult(src_now, final_dst, performed=True, reason=reason)
+        finally:
+            # Also when the caller closes the iterator early: what was undone
+            # must reach the history and the link view either way
+            if view_changes:
+                self.logger.apply_to_link_view(view_changes)
+            if history is not None:
+                history.write(restores)
+        if history is not None and not failed:
+            self.logger.forget_rules(batch_id)
+
+    def _op(self, nbytes: int = 0):
+        return self.throttle.op(nbytes) if self.throttle is not None else nullcontext()
+
+    def _io_bytes(self, src: Path, dst_dir: Path) -> int:
+        """Only a cross-device restore copies data; a rename costs no bytes."""
+        if self.throttle is None:
+            return 0
+        try:
+            st = self.fs.stat(src)
+            return 0 if st.st_dev == self.fs.stat(dst_dir).st_dev else st.st_size
+        except OSError:
+            return 0
+
+    def _ensure_dir(self, d: Path, made: Set[Path]) -> None:
+        """mkdir once per directory per undo run instead of once per file."""
+        if d not in made:
+            self.fs.mkdir(d)
+            made.add(d)
+
+    def _undo_link(self, e: MoveLogEntry) -> MoveResult:
+        """Tear down a link made by the batch, or re-create one it removed."""
+        if e.action == "unlink":
+            if self.fs.lexists(e.dst):
+                return MoveResult(e.src, e.dst, performed=False, reason="link path taken", action="link")
+            if not self.fs.exists(e.src):
+                return MoveResult(e.src, e.dst, performed=False, reason="missing source for undo", action="link")
             if self.dry_run:
-                results.append(MoveResult(src_now, final_dst, performed=False, reason=reason))
-                continue
+                return MoveResult(e.src, e.dst, performed=False, action="link")
+            try:
+                self.fs.mkdir(e.dst.parent)
+                with self._op():
+                    action = self.fs.make_link(e.src, e.dst)
+            except OSError as err:
+                return MoveResult(e.src, e.dst, performed=False, reason=_failure(err), action="link")
+            return MoveResult(e.src, e.dst, performed=True, action=action)
+
+        if not self.fs.lexists(e.dst):
+            return MoveResult(e.dst, e.src, performed=False, reason="link already gone", action="unlink")
+        if link_replaced(self.fs, e.src, e.dst, e.action):
+            return MoveResult(e.dst, e.src, performed=False, reason=REPLACED_REASON, action="unlink")
+        if is_last_copy(self.fs, e.src, e.dst, e.action):
+            return MoveResult(e.dst, e.src, performed=False, reason=LAST_COPY_REASON, action="unlink")
+        if self.dry_run:
+            return MoveResult(e.dst, e.src, performed=False, action="unlink")
+        try:
+            with self._op():
+                self.fs.unlink(e.dst)
+        except OSError as err:
+            return MoveResult(e.dst, e.src, performed=False, reason=_failure(err), action="unlink")
+        return MoveResult(e.dst, e.src, performed=True, action="unlink")
 
-            final_dst.parent.mkdir(parents=True, exist_ok=True)
-            shutil.move(str(src_now), str(final_dst))
-            results.append(MoveResult(src_now, final_dst, performed=True, reason=reason))
 
-        return results
+def _failure(err: OSError) -> str:
+    """Reason text for a failed entry, worded like SafeMover's."""
+    return f"perm-denied: {err}" if isinstance(err, PermissionError) else f"os-error: {err}"
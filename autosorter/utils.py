@@ -1,6 +1,11 @@
 from pathlib import Path
+from typing import Optional
+import os
 import shutil
+import sys
+import threading
 from .errors import *
+from .filesystem import FileSystem, LOCAL_FS
 
 def ensure_path(path_str: str) -> Path:
     """Return a resolved Path object and ensure it exists."""
@@ -10,12 +15,13 @@ def ensure_path(path_str: str) -> Path:
     return p
 
 
-def unique_path(dest: Path) -> Path:
+def unique_path(dest: Path, fs: Optional[FileSystem] = None) -> Path:
     """
-    If dest exists, append ' (1)', ' (2)', ... before the suffix.
-    Returns a Path that does not exist.
+    If dest is taken, append ' (1)', ' (2)', ... before the suffix.
+    Returns a Path that does not exist, not even as a dangling symlink.
     """
-    if not dest.exists():
+    fs = fs or LOCAL_FS
+    if not fs.lexists(dest):
         return dest
 
     stem = dest.stem
@@ -24,11 +30,50 @@ def unique_path(dest: Path) -> Path:
     i = 1
     while True:
         candidate = parent / f"{stem} ({i}){suffix}"
-        if not candidate.exists():
+        if not fs.lexists(candidate):
             return candidate
         i += 1
 
 
+def temp_sibling(path: Path) -> Path:
+    """Hidden, per-process/thread temp name next to path (same dir → atomic replace)."""
+    return path.with_name(f".{path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+
+
+def atomic_write_text(path: Path, text: str, fs: Optional[FileSystem] = None) -> None:
+    """Write to a temp file next to path, then rename over it; readers never see half a file."""
+    fs = fs or LOCAL_FS
+    tmp = temp_sibling(path)
+    try:
+        with fs.open(tmp, "w", encoding="utf-8", newline="") as f:
+            f.write(text)
+            fs.fsync(f)
+        fs.replace(tmp, path)
+    except BaseException:
+        try:
+            fs.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def lower_thread_priority(niceness: int = 10) -> bool:
+    """
+    Raise the nice value of the calling thread only (Linux threads have their
+    own). Elsewhere this is a no-op. Returns True if the priority changed.
+    """
+    # Only Linux maps PRIO_PROCESS + thread id to a single thread
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        tid = threading.get_native_id()
+        current = os.getpriority(os.PRIO_PROCESS, tid)
+        os.setpriority(os.PRIO_PROCESS, tid, min(19, current + niceness))
+        return True
+    except OSError:
+        return False
+
+
 def validate_source_dest(src: Path, dest: Path) -> None:
     if not src.exists() or not src.is_dir():
         raise InvalidPathError(f"Source folder invalid: {src}")
@@ -1,24 +1,32 @@
 # gui.py
 import threading
 import queue
-from datetime import datetime
 from pathlib import Path
-from typing import Optional, List, Tuple
+from typing import Dict, Optional, Tuple
 import json
 
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 
-from autosorter.utils import ensure_path
+from autosorter.utils import ensure_path, lower_thread_priority
 from autosorter.scanner import FolderScanner
 from autosorter.classifier import RuleSet, Classifier
-from autosorter.mover import SafeMover
-from autosorter.logger import MoveLogger
+from autosorter.mover import LAST_COPY_REASON
+from autosorter.logger import MoveLogger, new_batch_id
 from autosorter.undo import UndoManager
-from autosorter.models import MoveLogEntry, MoveResult
+from autosorter.models import MoveResult
+from autosorter.pipeline import OrganizePipeline, DEFAULT_MEMORY_LIMIT_MB
+from autosorter.plancache import CachedPlan, PlanKey, build_plan
+from autosorter.throttle import Throttle, control_path, set_idle_io_priority
 
 CONFIG_NAME = "gui_config.json"
 MAX_LOG_LINES = 500  # keep widget light
+PROGRESS_EVERY = 200  # files between progress updates
+PREVIEW_LINES = 50
+PRESCAN_DELAY_MS = 800  # after a path was picked, restored or a run finished
+PRESCAN_TYPED_DELAY_MS = 5000  # a typed path must sit unchanged this long (not "/" on the way)
+PRESCAN_JOIN_SEC = 0.1  # how often Stop is checked while waiting for the pre-scan
+MB = 1024 * 1024
 
 
 class AutoSorterGUI(tk.Tk):
@@ -34,9 +42,27 @@ class AutoSorterGUI(tk.Tk):
 
         self.worker_thread: Optional[threading.Thread] = None
         self.stop_requested = False
+        self.memory_limit_mb = DEFAULT_MEMORY_LIMIT_MB
+
+        # Speculative background scan; Start reuses its plan while still fresh
+        self.plan_lock = threading.Lock()
+        self.cached_plan: Optional[CachedPlan] = None
+        self.prescan_thread: Optional[threading.Thread] = None
+        self.prescan_key: Optional[PlanKey] = None
+        self.prescan_cancel = threading.Event()
+        self._prescan_after: Optional[str] = None
+
+        # One throttle per running job ("organize", "undo <batch>"); "Apply" retunes
+        # all of them. Only touched on the main thread.
+        self.throttles: Dict[str, Throttle] = {}
 
         self._build_ui()
         self._load_config()
+        for var in (self.src_var, self.dst_var, self.rules_var):
+            var.trace_add("write", lambda *_: self._schedule_prescan(PRESCAN_TYPED_DELAY_MS))
+        self.recursive_var.trace_add("write", lambda *_: self._schedule_prescan())
+        self._schedule_prescan()
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
         self._poll_queues()
 
     # ---------------- UI ----------------
@@ -58,6 +84,12 @@ class AutoSorterGUI(tk.Tk):
         self.rules_var = tk.StringVar()
         self.recursive_var = tk.BooleanVar(value=True)
         self.dry_run_var = tk.BooleanVar(value=True)
+        self.link_var = tk.BooleanVar(value=False)
+        self.collapse_var = tk.BooleanVar(value=False)
+        self.limit_mbps_var = tk.StringVar()
+        self.limit_ops_var = tk.StringVar()
+        self.limit_latency_var = tk.StringVar()
+        self.low_prio_var = tk.BooleanVar(value=False)
 
         self._file_picker(frm, "Source folder:", self.src_var, row=0, is_dir=True)
         self._file_picker(frm, "Destination root (blank = source):", self.dst_var, row=1, is_dir=True)
@@ -68,9 +100,24 @@ class AutoSorterGUI(tk.Tk):
             .grid(row=3, column=0, sticky="w", pady=2)
         ttk.Checkbutton(frm, text="Dry run first", variable=self.dry_run_var)\
             .grid(row=3, column=1, sticky="w", pady=2)
+        ttk.Checkbutton(frm, text="Link instead of move", variable=self.link_var)\
+            .grid(row=3, column=2, sticky="w", pady=2)
+        ttk.Checkbutton(frm, text="Remove emptied folders", variable=self.collapse_var)\
+            .grid(row=4, column=0, sticky="w", pady=2)
+
+        limits = ttk.Frame(frm)
+        limits.grid(row=5, column=0, columnspan=3, sticky="w", pady=2)
+        ttk.Label(limits, text="Limits (blank = none)  MB/s:").pack(side="left")
+        ttk.Entry(limits, textvariable=self.limit_mbps_var, width=7).pack(side="left", padx=(2, 8))
+        ttk.Label(limits, text="ops/s:").pack(side="left")
+        ttk.Entry(limits, textvariable=self.limit_ops_var, width=7).pack(side="left", padx=(2, 8))
+        ttk.Label(limits, text="back off above ms:").pack(side="left")
+        ttk.Entry(limits, textvariable=self.limit_latency_var, width=7).pack(side="left", padx=(2, 8))
+        ttk.Checkbutton(limits, text="Low priority", variable=self.low_prio_var).pack(side="left")
+        ttk.Button(limits, text="Apply limits", command=self.on_apply_limits).pack(side="left", padx=(8, 0))
 
         btns = ttk.Frame(frm)
-        btns.grid(row=4, column=0, columnspan=3, sticky="w", pady=8)
+        btns.grid(row=6, column=0, columnspan=3, sticky="w", pady=8)
         self.btn_start = ttk.Button(btns, text="Start", command=self.on_start)
         self.btn_start.pack(side="left")
         self.btn_stop = ttk.Button(btns, text="Stop", command=self.on_stop, state="disabled")
@@ -136,6 +183,7 @@ class AutoSorterGUI(tk.Tk):
                 path = filedialog.askopenfilename(filetypes=filetypes or [("All files", "*.*")])
             if path:
                 var.set(path)
+                self._schedule_prescan()  # a picked path is final; no need to wait as for typing
 
         ttk.Button(parent, text="Browse", command=browse).grid(row=row, column=2, padx=5)
 
@@ -216,6 +264,13 @@ class AutoSorterGUI(tk.Tk):
 
         recursive = self.recursive_var.get()
         dry_run = self.dry_run_var.get()
+        link_mode = self.link_var.get()
+        collapse = self.collapse_var.get()
+        try:
+            throttle = self._make_throttle(dest_root)
+        except ValueError as e:
+            messagebox.showerror("Error", f"Invalid limit: {e}")
+            return
 
         # Save config
         self._save_config(source, dest_root, rules_path)
@@ -229,72 +284,118 @@ class AutoSorterGUI(tk.Tk):
         self._clear_text(self.txt_log)
         self.set_status("Running...")
 
-        args = (source, dest_root, rules_path, recursive, dry_run)
+        self.throttles["organize"] = throttle
+        args = (source, dest_root, rules_path, recursive, dry_run, throttle, link_mode, collapse)
         self.worker_thread = threading.Thread(target=self._organize_worker, args=args, daemon=True)
         self.worker_thread.start()
 
+    def on_apply_limits(self):
+        try:
+            bytes_per_sec, ops_per_sec, latency = self._read_limits()
+        except ValueError as e:
+            messagebox.showerror("Error", f"Invalid limit: {e}")
+            return
+        for throttle in self.throttles.values():
+            throttle.set_limits(bytes_per_sec, ops_per_sec, latency)
+        if self.throttles:
+            self.set_status(f"Limits applied to {len(self.throttles)} running job(s).")
+        else:
+            self.set_status("Limits will apply to the next run.")
+
+    def _read_limits(self) -> Tuple[float, float, float]:
+        def num(var: tk.StringVar) -> float:
+            text = var.get().strip()
+            return float(text) if text else 0.0
+        return num(self.limit_mbps_var) * MB, num(self.limit_ops_var), num(self.limit_latency_var) / 1000
+
+    def _make_throttle(self, root: Path) -> Throttle:
+        bytes_per_sec, ops_per_sec, latency = self._read_limits()
+        low = self.low_prio_var.get()
+        # The control file lets `main.py` option 5 retune a GUI run too
+        return Throttle(bytes_per_sec, ops_per_sec, latency, idle_io=low,
+                        niceness=10 if low else 0, control_file=control_path(root))
+
     def on_stop(self):
         self.stop_requested = True
         self.log("Stop requested. Finishing current file...")
 
     # ---------------- Worker ----------------
     def _organize_worker(self, source: Path, dest_root: Path, rules_path: Optional[Path],
-                         recursive: bool, dry_run_first: bool):
+                         recursive: bool, dry_run_first: bool, throttle: Throttle,
+                         link_mode: bool = False, collapse: bool = False):
         try:
-            self.log("Scanning...")
             scanner = FolderScanner(source, recursive=recursive)
-            files = scanner.scan()
-            self.log(f"Found {len(files)} files.")
-
-            rule_set = RuleSet(rules_path)
-            classifier = Classifier(rule_set)
-            pairs = classifier.assign(files)
-
-            # Dry run
-            mover = SafeMover(dest_root, dry_run=True)
-            previews = mover.move_many(pairs)
-            self.log("--- DRY RUN ---")
-            for r in previews[:50]:
-                flag = f" ({r.reason})" if r.reason else ""
-                self.log(f"{r.src.name} -> {r.dst}{flag}")
-            if len(previews) > 50:
-                self.log(f"...and {len(previews)-50} more")
-
-            if dry_run_first:
-                proceed = self._ask_user_yes_no("Proceed with actual move?")
-                if not proceed:
-                    self.log("Aborted after dry-run.")
-                    return
-                if self.stop_requested:
-                    self.log("Stopped before real move.")
+            classifier = Classifier(RuleSet(rules_path))
+            if link_mode:
+                self._link_worker(scanner, classifier, dest_root, dry_run_first, throttle)
+                return
+
+            key = PlanKey(source, dest_root, rules_path, recursive)
+            cached = self._take_cached_plan(key)
+            if cached is not None:
+                self.log("Using background pre-scan.")
+            elif self.stop_requested:
+                self.log("Stopped during scan.")
+                return
+            else:
+                self.log("Scanning...")
+                cached = build_plan(key, self.memory_limit_mb, PREVIEW_LINES,
+                                    cancelled=lambda: self.stop_requested)
+                if cached is None:
+                    self.log("Stopped during scan.")
                     return
 
-            # Real move
-            mover = SafeMover(dest_root, dry_run=False)
-            total = len(pairs)
-            moved_results: List[MoveResult] = []
-            for idx, (rec, folder) in enumerate(pairs, 1):
+            keep_plan = False
+            try:
+                plan = cached.plan
+                total = len(plan)
+                self.log(f"Found {total} files.")
+
+                # Dry run
+                self.log("--- DRY RUN ---")
+                for r in cached.previews:
+                    flag = f" ({r.reason})" if r.reason else ""
+                    self.log(f"{r.src.name} -> {r.dst}{flag}")
+                if total > PREVIEW_LINES:
+                    self.log(f"...and {total-PREVIEW_LINES} more")
+
+                if dry_run_first:
+                    proceed = self._ask_user_yes_no("Proceed with actual move?")
+                    if not proceed or self.stop_requested:
+                        # Nothing moved, so the plan stays valid for the next Start
+                        keep_plan = True
+                        self.log("Aborted after dry-run." if not proceed else "Stopped before real move.")
+                        return
+
+                # Real move; per-file lines are capped so the log queue stays small
+                shown = [0]
+
+                def on_result(res: MoveResult):
+                    if shown[0] < MAX_LOG_LINES:
+                        self.log(f"MOVED: {res.src.name} -> {res.dst}")
+                    shown[0] += 1
+
+                def on_progress(cur: int, tot: int):
+                    if cur % PROGRESS_EVERY == 0 or cur == tot:
+                        self.update_progress(cur, tot)
+
+                pipeline = OrganizePipeline(dest_root, classifier, self.memory_limit_mb,
+                                            throttle=throttle)
+                batch_id = new_batch_id()
+                moved = pipeline.execute(plan, batch_id, on_result=on_result,
+                                         should_stop=lambda: self.stop_requested,
+                                         on_progress=on_progress,
+                                         collapse_root=source if collapse else None)
                 if self.stop_requested:
                     self.log("Stop detected; ending early.")
-                    break
-                res = mover.move_one(rec, folder)
-                if res.performed:
-                    self.log(f"MOVED: {res.src.name} -> {res.dst}")
-                    moved_results.append(res)
-                self.update_progress(idx, total)
+            finally:
+                if keep_plan:
+                    self._return_cached_plan(cached)
+                else:
+                    cached.close()
 
-            moved = len(moved_results)
             self.log(f"Moved {moved} files.")
-
-            # Log batch
             if moved > 0:
-                batch_id = datetime.now().strftime("%Y%m%d-%H%M%S")
-                logger = MoveLogger(dest_root)
-                entries = [
-                    MoveLogEntry(batch_id, r.src, r.dst, datetime.now())
-                    for r in moved_results
-                ]
-                logger.write_batch(entries)
                 self.log(f"Batch logged as {batch_id}")
             else:
                 self.log("Nothing to log.")
@@ -305,13 +406,165 @@ class AutoSorterGUI(tk.Tk):
         finally:
             self.after(0, self._finish_worker)
 
+    def _link_worker(self, scanner: FolderScanner, classifier: Classifier, dest_root: Path,
+                     dry_run_first: bool, throttle: Throttle):
+        pipeline = OrganizePipeline(dest_root, classifier, self.memory_limit_mb, throttle=throttle)
+        self.log("Scanning...")
+        with pipeline.plan(scanner.iter_files()) as plan:
+            total = len(plan)
+            self.log(f"Found {total} files.")
+
+            # Dry run
+            previews, changes = pipeline.preview_links(plan, PREVIEW_LINES, scanner.root, scanner.recursive)
+            self.log("--- DRY RUN ---")
+            for r in previews:
+                flag = f" ({r.reason})" if r.reason else ""
+                self.log(f"[{r.action}] {r.src.name} -> {r.dst}{flag}")
+            if changes > PREVIEW_LINES:
+                self.log(f"...and {changes-PREVIEW_LINES} more")
+
+            if dry_run_first:
+                proceed = self._ask_user_yes_no("Proceed with linking?")
+                if not proceed:
+                    self.log("Aborted after dry-run.")
+                    return
+                if self.stop_requested:
+                    self.log("Stopped before linking.")
+                    return
+
+            # Incremental sync only touches changed links; per-file lines are capped
+            shown = [0]
+
+            def on_result(res: MoveResult):
+                if shown[0] >= MAX_LOG_LINES:
+                    return
+                if res.performed:
+                    self.log(f"{res.action.upper()}: {res.src.name} -> {res.dst}")
+                elif res.reason == LAST_COPY_REASON:
+                    self.log(f"KEPT (only copy left): {res.dst}")
+                else:
+                    return
+                shown[0] += 1
+
+            batch_id = new_batch_id()
+            applied = pipeline.execute_links(plan, batch_id, scanner.root, scanner.recursive,
+                                             on_result=on_result,
+                                             should_stop=lambda: self.stop_requested)
+        self.update_progress(total, total)
+        self.log(f"Applied {applied} link changes.")
+        self.log(f"Batch logged as {batch_id}" if applied else "Nothing to log.")
+
     def _finish_worker(self):
+        self.throttles.pop("organize", None)
         self.btn_start.config(state="normal")
         self.btn_stop.config(state="disabled")
         self.set_status("Ready")
         self.progress.stop()
         self.progress.config(value=0, mode="determinate")
         self.lbl_progress.config(text="")
+        # The tree just changed (or the cache was handed back); get ahead of the next Start
+        self._schedule_prescan()
+
+    # ---------------- Background pre-scan ----------------
+    def _current_key(self) -> Optional[PlanKey]:
+        """
+        Same path handling as on_start, but silent: None if anything is
+        invalid. A blank source is None too (on_start would scan the working
+        directory, but that is never worth doing speculatively).
+        """
+        if not self.src_var.get().strip():
+            return None
+        try:
+            source = ensure_path(self.src_var.get())
+            dest_input = self.dst_var.get().strip()
+            dest_root = ensure_path(dest_input) if dest_input else source
+            rules_path = None
+            if self.rules_var.get().strip():
+                rules_path = ensure_path(self.rules_var.get())
+            return PlanKey(source, dest_root, rules_path, self.recursive_var.get())
+        except Exception:
+            return None
+
+    def _schedule_prescan(self, delay_ms: int = PRESCAN_DELAY_MS):
+        if self._prescan_after is not None:
+            self.after_cancel(self._prescan_after)
+        self._prescan_after = self.after(delay_ms, self._start_prescan)
+
+    def _start_prescan(self):
+        self._prescan_after = None
+        key = self._current_key()
+        if key is None or (self.worker_thread and self.worker_thread.is_alive()):
+            return
+        with self.plan_lock:
+            if self.cached_plan is not None and self.cached_plan.key == key:
+                return  # freshness is checked cheaply when Start is clicked
+        if self.prescan_thread and self.prescan_thread.is_alive():
+            if self.prescan_key == key:
+                return
+            self.prescan_cancel.set()
+
+        self.prescan_cancel = threading.Event()
+        self.prescan_key = key
+        self.prescan_thread = threading.Thread(target=self._prescan_worker,
+                                               args=(key, self.prescan_cancel), daemon=True)
+        self.prescan_thread.start()
+
+    def _prescan_worker(self, key: PlanKey, cancel: threading.Event):
+        # Speculative work: stay out of the way of both CPU and disk
+        lower_thread_priority()
+        set_idle_io_priority()
+        try:
+            result = build_plan(key, self.memory_limit_mb, PREVIEW_LINES, cancelled=cancel.is_set)
+        except Exception:
+            return  # speculative; Start will scan again and report errors
+        if result is None:
+            return
+        with self.plan_lock:
+            if cancel.is_set():
+                result.close()
+                return
+            if self.cached_plan is not None:
+                self.cached_plan.close()
+            self.cached_plan = result
+        self.after(0, lambda: self.set_status(f"Pre-scan ready: {len(result.plan)} files"))
+
+    def _take_cached_plan(self, key: PlanKey) -> Optional[CachedPlan]:
+        """
+        Hand the cached plan for key to the caller if it is still fresh.
+        Waiting for a pre-scan still in progress ends on Stop, which also
+        cancels it; the caller then sees stop_requested and gives up.
+        """
+        thread = self.prescan_thread
+        if thread and thread.is_alive():
+            if self.prescan_key == key:
+                self.log("Waiting for background scan...")
+                while thread.is_alive() and not self.stop_requested:
+                    thread.join(PRESCAN_JOIN_SEC)
+            if thread.is_alive():
+                self.prescan_cancel.set()
+        with self.plan_lock:
+            cached, self.cached_plan = self.cached_plan, None
+        if cached is None:
+            return None
+        if cached.key == key and cached.is_fresh():
+            return cached
+        cached.close()
+        return None
+
+    def _return_cached_plan(self, cached: CachedPlan):
+        with self.plan_lock:
+            if self.cached_plan is None:
+                self.cached_plan = cached
+                return
+        cached.close()
+
+    def _on_close(self):
+        self.prescan_cancel.set()
+        with self.plan_lock:
+            if self.cached_plan is not None:
+                self.cached_plan.close()
+                self.cached_plan = None
+        self.destroy()
 
     def _ask_user_yes_no(self, question: str) -> bool:
         # Must run on main thread
@@ -366,15 +619,18 @@ class AutoSorterGUI(tk.Tk):
 
         logger = MoveLogger(dest_root)
         undo_mgr = UndoManager(dest_root, logger, dry_run=True)
-        previews = undo_mgr.undo_batch(batch)
 
         self._clear_text(self.txt_undo_log)
         self.log_undo(f"--- Preview undo of {batch} ---")
-        for r in previews[:100]:
-            flag = f" ({r.reason})" if r.reason else ""
-            self.log_undo(f"{r.src.name} -> {r.dst}{flag}")
-        if len(previews) > 100:
-            self.log_undo(f"...and {len(previews)-100} more")
+        # Only the shown lines are kept; the rest of the batch is just counted
+        count = 0
+        for r in undo_mgr.iter_undo(batch):
+            if count < 100:
+                flag = f" ({r.reason})" if r.reason else ""
+                self.log_undo(f"{r.src.name} -> {r.dst}{flag}")
+            count += 1
+        if count > 100:
+            self.log_undo(f"...and {count-100} more")
 
         self.btn_undo_run.config(state="normal")
 
@@ -387,11 +643,29 @@ class AutoSorterGUI(tk.Tk):
 
         root_str = self.undo_root_var.get().strip() or "."
         dest_root = ensure_path(root_str)
-        logger = MoveLogger(dest_root)
-        undo_mgr = UndoManager(dest_root, logger, dry_run=False)
-        results = undo_mgr.undo_batch(batch)
-        restored = sum(1 for r in results if r.performed)
-        self.log_undo(f"Restored {restored} files from batch {batch}.")
+        try:
+            throttle = self._make_throttle(dest_root)
+        except ValueError as e:
+            messagebox.showerror("Error", f"Invalid limit: {e}")
+            return
+
+        # Throttled undo can take a while; keep the window responsive
+        self.btn_undo_run.config(state="disabled")
+        self.log_undo(f"Undoing batch {batch}...")
+        self.throttles[f"undo {batch}"] = throttle
+        threading.Thread(target=self._undo_worker, args=(dest_root, batch, throttle),
+                         daemon=True).start()
+
+    def _undo_worker(self, dest_root: Path, batch: str, throttle: Throttle):
+        try:
+            logger = MoveLogger(dest_root)
+            undo_mgr = UndoManager(dest_root, logger, dry_run=False, throttle=throttle)
+            restored = undo_mgr.undo_batch(batch)
+            self.log_undo(f"Undo complete. Restored {restored} entries from batch {batch}.")
+        except Exception as e:
+            self.log_undo(f"ERROR: {e}")
+        finally:
+            self.after(0, lambda: self.throttles.pop(f"undo {batch}", None))
 
     # ---------------- Config ----------------
     def _config_path(self) -> Path:
@@ -408,6 +682,7 @@ class AutoSorterGUI(tk.Tk):
                 self.dst_var.set(data.get("dest", ""))
                 self.rules_var.set(data.get("rules", ""))
                 self.undo_root_var.set(data.get("undo_root", ""))
+                self.memory_limit_mb = int(data.get("memory_limit_mb", DEFAULT_MEMORY_LIMIT_MB))
         except Exception:
             pass  # ignore bad config
 
@@ -419,6 +694,7 @@ class AutoSorterGUI(tk.Tk):
             "dest": str(dest_root),
             "rules": str(rules_path) if rules_path else "",
             "undo_root": str(dest_root),
+            "memory_limit_mb": self.memory_limit_mb,
         }
         try:
             self._config_path().write_text(json.dumps(data, indent=2), encoding="utf-8")
@@ -1,17 +1,35 @@
+from itertools import islice
 from pathlib import Path
-from datetime import datetime
+from typing import Tuple
 
 from autosorter.utils import ensure_path
 from autosorter.scanner import FolderScanner
 from autosorter.classifier import RuleSet, Classifier
-from autosorter.mover import SafeMover
-from autosorter.logger import MoveLogger
+from autosorter.mover import LAST_COPY_REASON
+from autosorter.logger import MoveLogger, new_batch_id
 from autosorter.undo import UndoManager
-from autosorter.models import MoveLogEntry
+from autosorter.report import ReportBuilder
+from autosorter.pipeline import OrganizePipeline, DEFAULT_MEMORY_LIMIT_MB
+from autosorter.reclassify import Reclassifier
+from autosorter.throttle import Throttle, control_path, write_control_file
+
+MB = 1024 * 1024
 
 def ask_yes_no(prompt: str) -> bool:
     return input(prompt + " [y/N]: ").strip().lower() == "y"
 
+def ask_limits() -> Tuple[float, float, float]:
+    raw = input("I/O limits as 'MB/s ops/s latency-ms' (blank = unlimited): ").split()
+    nums = [float(x) for x in raw] + [0.0] * (3 - len(raw))
+    return nums[0] * MB, nums[1], nums[2] / 1000
+
+def ask_throttle(root: Path) -> Throttle:
+    """Limits for this run; option 5 can change them while it is running."""
+    bytes_per_sec, ops_per_sec, latency = ask_limits()
+    low = ask_yes_no("Run at low CPU/disk priority?")
+    return Throttle(bytes_per_sec, ops_per_sec, latency, idle_io=low, niceness=10 if low else 0,
+                    control_file=control_path(root))
+
 def organize_flow():
     source = ensure_path(input("Source folder to organize: ").strip())
     dest_input = input("Destination root (blank = same as source): ").strip()
@@ -20,44 +38,72 @@ def organize_flow():
     rules_file = input("Path to rules.json (leave empty for defaults): ").strip() or None
     rules_path = Path(rules_file).expanduser().resolve() if rules_file else None
 
-    # Scan
-    scanner = FolderScanner(source, recursive=True)
-    files = scanner.scan()
-
-    # Classify
-    rule_set = RuleSet(rules_path)
-    classifier = Classifier(rule_set)
-    pairs = classifier.assign(files)
-
-    # Dry-run
-    mover = SafeMover(dest_root, dry_run=True)
-    previews = mover.move_many(pairs)
-    print("\n--- DRY RUN --- (first 30 shown)")
-    for r in previews[:30]:
-        flag = f"({r.reason})" if r.reason else ""
-        print(f"{r.src.name:40} -> {r.dst} {flag}")
-    print(f"\nTotal files planned: {len(previews)}")
+    link_mode = ask_yes_no("Link-farm mode (keep sources in place, build view from links)?")
+    mem_input = input(f"Memory limit in MB (blank = {DEFAULT_MEMORY_LIMIT_MB}): ").strip()
+    memory_limit_mb = int(mem_input) if mem_input else DEFAULT_MEMORY_LIMIT_MB
+
+    throttle = ask_throttle(dest_root)
 
-    if not ask_yes_no("Proceed with actual move?"):
-        print("Aborted (dry-run only).")
+    scanner = FolderScanner(source, recursive=True)
+    classifier = Classifier(RuleSet(rules_path))
+    if link_mode:
+        link_flow(scanner, classifier, dest_root, throttle, memory_limit_mb)
         return
 
-    # Real move
-    mover = SafeMover(dest_root, dry_run=False)
-    results = mover.move_many(pairs)
+    # Scan + classify, spilling the plan to disk past the memory limit
+    pipeline = OrganizePipeline(dest_root, classifier, memory_limit_mb, throttle=throttle)
+    with pipeline.plan(scanner.iter_files()) as plan:
+        # Dry-run
+        print("\n--- DRY RUN --- (first 30 shown)")
+        for r in pipeline.preview(plan, 30):
+            flag = f"({r.reason})" if r.reason else ""
+            print(f"{r.src.name:40} -> {r.dst} {flag}")
+        print(f"\nTotal files planned: {len(plan)}")
 
-    # Log
-    batch_id = datetime.now().strftime("%Y%m%d-%H%M%S")
-    logger = MoveLogger(dest_root)
-    entries = [
-        MoveLogEntry(batch_id, r.src, r.dst, datetime.now())
-        for r in results if r.performed
-    ]
-    logger.write_batch(entries)
+        if not ask_yes_no("Proceed with actual move?"):
+            print("Aborted (dry-run only).")
+            return
+
+        collapse = ask_yes_no("Remove source folders left empty afterwards?")
+
+        # Real move + log, chunk by chunk
+        batch_id = new_batch_id()
+        moved = pipeline.execute(plan, batch_id, collapse_root=source if collapse else None)
 
-    moved = len(entries)
     print(f"\nDone. Moved {moved} files. Batch ID: {batch_id}")
 
+def link_flow(scanner: FolderScanner, classifier: Classifier, dest_root: Path, throttle: Throttle,
+              memory_limit_mb: int):
+    pipeline = OrganizePipeline(dest_root, classifier, memory_limit_mb, throttle=throttle)
+    with pipeline.plan(scanner.iter_files()) as plan:
+        # Dry-run
+        previews, total = pipeline.preview_links(plan, 30, scanner.root, scanner.recursive)
+        print("\n--- DRY RUN --- (first 30 shown)")
+        for r in previews:
+            flag = f"({r.reason})" if r.reason else ""
+            print(f"[{r.action}] {r.src.name:40} -> {r.dst} {flag}")
+        print(f"\nTotal link changes planned: {total}")
+
+        if not ask_yes_no("Proceed with linking?"):
+            print("Aborted (dry-run only).")
+            return
+
+        kept = []
+
+        def on_result(r):
+            if r.reason == LAST_COPY_REASON and len(kept) < 10:
+                kept.append(r.dst)
+
+        batch_id = new_batch_id()
+        applied = pipeline.execute_links(plan, batch_id, scanner.root, scanner.recursive,
+                                         on_result=on_result)
+
+    print(f"\nDone. Applied {applied} link changes. Batch ID: {batch_id}")
+    if kept:
+        print("Kept links whose source is gone (they hold the only copy), e.g.:")
+        for p in kept:
+            print(f"  {p}")
+
 def undo_flow():
     dest_root = ensure_path(input("Destination root (where .autosorter lives): ").strip() or ".")
     logger = MoveLogger(dest_root)
@@ -73,26 +119,98 @@ def undo_flow():
     batch_id = batches[idx]
 
     undo_mgr = UndoManager(dest_root, logger, dry_run=True)
-    previews = undo_mgr.undo_batch(batch_id)
-    print("\n--- UNDO DRY RUN ---")
-    for r in previews[:30]:
+    print("\n--- UNDO DRY RUN --- (first 30 shown)")
+    for r in islice(undo_mgr.iter_undo(batch_id), 30):
         flag = f"({r.reason})" if r.reason else ""
         print(f"{r.src.name:40} -> {r.dst} {flag}")
     if not ask_yes_no("Perform undo?"):
         print("Undo cancelled.")
         return
 
-    undo_mgr = UndoManager(dest_root, logger, dry_run=False)
-    done = undo_mgr.undo_batch(batch_id)
-    performed = sum(1 for r in done if r.performed)
-    print(f"Undo complete. Restored {performed} files.")
+    throttle = ask_throttle(dest_root)
+    undo_mgr = UndoManager(dest_root, logger, dry_run=False, throttle=throttle)
+    restored = undo_mgr.undo_batch(batch_id)
+    print(f"Undo complete. Restored {restored} entries.")
+
+def report_flow():
+    source = ensure_path(input("Source folder to analyze: ").strip())
+    dest_input = input("Destination root (blank = same as source): ").strip()
+    dest_root = ensure_path(dest_input) if dest_input else source
+
+    rules_file = input("Path to rules.json (leave empty for defaults): ").strip() or None
+    rules_path = Path(rules_file).expanduser().resolve() if rules_file else None
+    as_json = input("Output format [text/json] (blank = text): ").strip().lower() == "json"
+
+    # Scan + classify lazily; nothing is moved and no records are kept
+    scanner = FolderScanner(source, recursive=True)
+    classifier = Classifier(RuleSet(rules_path))
+    report = ReportBuilder(dest_root).build(classifier.iter_assign(scanner.iter_files()))
+
+    print()
+    print(report.to_json() if as_json else report.to_text())
+
+def resort_flow():
+    dest_root = ensure_path(input("Destination root (where .autosorter lives): ").strip() or ".")
+    rules_file = input("Path to the updated rules.json (leave empty for defaults): ").strip() or None
+    rules_path = Path(rules_file).expanduser().resolve() if rules_file else None
+
+    logger = MoveLogger(dest_root)
+    reclassifier = Reclassifier(dest_root, logger)
+    if not logger.load_rule_versions():
+        print("No rules recorded; run a normal organize first.")
+        return
+    new_rules = RuleSet(rules_path)
+
+    changed = reclassifier.changes(new_rules)
+    if not changed:
+        print("Rules unchanged; nothing to re-sort.")
+        return
+    print("\nChanged rules:")
+    for ext, (old, new) in sorted(changed.items()):
+        print(f"  {ext or 'no_extension':15} {', '.join(sorted(old))} -> {new}")
+
+    # Only files the history says carry a changed extension are looked at
+    throttle = ask_throttle(dest_root)
+    pipeline = OrganizePipeline(dest_root, Classifier(new_rules), throttle=throttle)
+    with pipeline.plan(reclassifier.iter_affected(new_rules)) as plan:
+        print("\n--- DRY RUN --- (first 30 shown)")
+        for r in pipeline.preview(plan, 30):
+            flag = f"({r.reason})" if r.reason else ""
+            print(f"{r.src.name:40} -> {r.dst} {flag}")
+        print(f"\nTotal files affected: {len(plan)}")
+
+        if not ask_yes_no("Proceed with re-sort?"):
+            print("Aborted (dry-run only).")
+            return
+
+        collapse = ask_yes_no("Remove category folders left empty afterwards?")
+
+        batch_id = new_batch_id()
+        moved = pipeline.execute(plan, batch_id, logger=logger, collapse_root=dest_root if collapse else None)
+
+    print(f"\nDone. Moved {moved} files. Batch ID: {batch_id}")
+
+def limits_flow():
+    dest_root = ensure_path(input("Destination root of the running job(s): ").strip() or ".")
+    bytes_per_sec, ops_per_sec, latency = ask_limits()
+    path = write_control_file(dest_root, bytes_per_sec, ops_per_sec, latency)
+    print(f"Limits written to {path}; running jobs pick them up within a second.")
 
 def main():
     print("1) Organize files")
     print("2) Undo last batch (or choose)")
+    print("3) Storage report (no changes)")
+    print("4) Re-sort after rules change")
+    print("5) Change I/O limits of running jobs")
     action = input("Select: ").strip()
     if action == "2":
         undo_flow()
+    elif action == "3":
+        report_flow()
+    elif action == "4":
+        resort_flow()
+    elif action == "5":
+        limits_flow()
     else:
         organize_flow()
 